@@ -0,0 +1,311 @@
+"""Modo por lotes: detecta figuras en directorios completos sin abrir la GUI.
+
+Uso::
+
+    python batch.py imagenes/ "otras/*.png" -j 8 -o resultados.jsonl
+    python batch.py imagenes/ --format npz -o resultados
+
+Cada imagen se procesa en un ``ProcessPoolExecutor`` y su resultado se entrega
+al exportador (JSONL, CSV o NPZ, ver ``export.py``) en cuanto termina (el orden
+de salida es el de finalización, no el de entrada). El número de tareas en
+vuelo está acotado para que la memoria no crezca con el tamaño del conjunto de
+entrada.
+
+Con ``--dedupe`` (o ``--dedupe-index indice.jsonl`` para conservarlo entre
+ejecuciones) las imágenes casi idénticas a otra ya procesada reutilizan su
+resultado en lugar de detectarse de nuevo (ver ``dedupe.py``).
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import astuple
+
+import cv2
+
+from cache import ResultCache
+from dedupe import DEFAULT_THRESHOLD, PerceptualIndex, duplicate_record, perceptual_hash
+from detector import DetectionParams, ShapeDetector, read_for_detection
+from export import EXPORT_FORMATS, open_exporter, result_to_record
+from templates import TemplateClassifier
+from tiled import TiledDetector
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff")
+
+# Detector propio de cada proceso trabajador (se crea en _init_worker)
+_worker_detector = None
+_worker_tiled = None
+_worker_contours = False
+
+
+def iter_image_paths(inputs, recursive=False):
+    """Expande directorios y patrones glob en rutas de imagen, sin duplicados."""
+    seen = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*") if recursive else os.path.join(item, "*")
+            candidates = sorted(glob.iglob(pattern, recursive=recursive))
+        elif glob.has_magic(item):
+            candidates = sorted(glob.iglob(item, recursive=recursive))
+        else:
+            candidates = [item]
+
+        for path in candidates:
+            if os.path.isdir(path):
+                continue
+            if path not in seen and path.lower().endswith(IMAGE_EXTENSIONS):
+                seen.add(path)
+                yield path
+
+
+def _init_worker(params, tile_size=None, overlap=256, cache_dir=None, cache_bytes=None,
+                 include_contours=False, classifier=None):
+    global _worker_detector, _worker_tiled, _worker_contours
+    # Evitar que cada proceso lance a su vez varios hilos de OpenCV
+    cv2.setNumThreads(1)
+    cache = ResultCache(cache_dir=cache_dir, max_bytes=cache_bytes) if cache_dir else None
+    _worker_detector = ShapeDetector(params, cache=cache, classifier=classifier)
+    _worker_tiled = TiledDetector(params, tile_size, overlap, classifier) if tile_size else None
+    _worker_contours = include_contours
+
+
+def process_image(path):
+    """Procesa una imagen en el trabajador y devuelve un registro serializable."""
+    start = time.perf_counter()
+    if _worker_tiled is not None:
+        result = _worker_tiled.detect(path)
+    else:
+        # Sin GUI no hace falta el color: decodificar directamente en grises
+        gray, factor = read_for_detection(path, _worker_detector.params)
+        if gray is None:
+            return {"path": path, "ok": False, "error": "No se pudo cargar la imagen"}
+        result = _worker_detector.detect(gray, scale=factor)
+
+    record = result_to_record(path, result, include_contours=_worker_contours)
+    record["seconds"] = round(time.perf_counter() - start, 6)
+    if result.stats is not None:
+        record["stats"] = result.stats.as_dict()
+    return record
+
+
+def hash_image(path):
+    """Hash perceptual de ``path`` en el trabajador (ver ``dedupe.perceptual_hash``)."""
+    return perceptual_hash(path)
+
+
+def run_batch(paths, exporter, params=None, workers=None, max_in_flight=None,
+              tile_size=None, overlap=256, cache_dir=None, cache_bytes=512 * 1024 * 1024,
+              include_contours=False, classifier=None, dedupe=False, dedupe_index=None,
+              dedupe_threshold=DEFAULT_THRESHOLD):
+    """Procesa ``paths`` en paralelo entregando un registro por imagen a ``exporter``.
+
+    ``exporter`` es cualquier objeto con ``write(registro)`` (ver ``export.py``);
+    ``include_contours`` añade los polígonos a cada registro.
+
+    Con ``tile_size`` cada imagen se procesa por mosaicos (ver ``tiled.py``).
+    Con ``cache_dir`` los resultados se guardan en una caché en disco compartida
+    por todos los procesos (ver ``cache.py``). ``classifier`` sustituye a las
+    reglas geométricas (ver ``templates.py``).
+
+    Con ``dedupe`` (implícito si se da ``dedupe_index``, un JSONL que se
+    conserva entre ejecuciones) cada imagen se pasa primero por un hash
+    perceptual y, si está a ``dedupe_threshold`` bits o menos de otra ya
+    procesada, se escribe el resultado de ésta con ``duplicate_of``. Las que
+    coinciden con una imagen que aún se está detectando esperan a su resultado.
+
+    Returns:
+        dict con el resumen (imágenes, fallos, duplicados, segundos, imágenes/s).
+    """
+    params = params or DetectionParams()
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 4
+    dedupe = dedupe or dedupe_index is not None
+
+    processed = failed = duplicates = 0
+    start = time.perf_counter()
+    paths = iter(paths)
+    index = None
+    if dedupe:
+        # Un resultado sólo se reutiliza con la misma configuración de detección
+        settings = repr((astuple(params), tile_size, overlap, include_contours,
+                         classifier.digest if classifier is not None else None))
+        index = PerceptualIndex(dedupe_index, settings, dedupe_threshold)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(params, tile_size, overlap, cache_dir, cache_bytes,
+                                       include_contours, classifier)) as pool:
+        pending = {}  # future -> (tipo, ruta, posición en el índice)
+        waiters = {}  # posición pendiente -> rutas casi idénticas a la espera
+
+        def submit_next():
+            for path in paths:
+                if index is not None:
+                    pending[pool.submit(hash_image, path)] = ("hash", path, None)
+                else:
+                    pending[pool.submit(process_image, path)] = ("detect", path, None)
+                return True
+            return False
+
+        def emit(record):
+            nonlocal processed, failed, duplicates
+            processed += 1
+            if not record["ok"]:
+                failed += 1
+            elif "duplicate_of" in record:
+                duplicates += 1
+            exporter.write(record)
+
+        # Llenar la ventana inicial
+        while len(pending) < max_in_flight and submit_next():
+            pass
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, path, pos = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"path": path, "ok": False, "error": str(e)}
+
+                if kind == "hash":
+                    value, size = result if isinstance(result, tuple) else (None, None)
+                    if value is None:
+                        emit(result if isinstance(result, dict) else
+                             {"path": path, "ok": False, "error": "No se pudo cargar la imagen"})
+                        submit_next()
+                        continue
+                    match = index.find(value, size)
+                    if match is None:
+                        # La tarea de detección ocupa el hueco de la de hash
+                        pos = index.add(value, size)
+                        pending[pool.submit(process_image, path)] = ("detect", path, pos)
+                    elif index.record(match) is None:
+                        waiters.setdefault(match, []).append(path)
+                        submit_next()
+                    else:
+                        emit(duplicate_record(index.record(match), path))
+                        submit_next()
+                    continue
+
+                record = result
+                if pos is not None:
+                    if record["ok"]:
+                        # Antes de exportar: el exportador puede modificar el registro
+                        index.resolve(pos, record)
+                        for other in waiters.pop(pos, ()):
+                            emit(duplicate_record(index.record(pos), other))
+                    else:
+                        index.discard(pos)
+                        for other in waiters.pop(pos, ()):
+                            pending[pool.submit(process_image, other)] = ("detect", other, None)
+                emit(record)
+                submit_next()
+
+    if index is not None:
+        index.close()
+    elapsed = time.perf_counter() - start
+    return {
+        "images": processed,
+        "failed": failed,
+        "duplicates": duplicates,
+        "seconds": elapsed,
+        "images_per_sec": processed / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Detecta figuras geométricas en lotes de imágenes."
+    )
+    parser.add_argument("inputs", nargs="+", help="Directorios, archivos o patrones glob")
+    parser.add_argument("-o", "--output", help="Archivo de salida (por defecto stdout)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="jsonl",
+                        help="Formato de salida; npz escribe bloques <salida>.00000.npz")
+    parser.add_argument("--contours", action="store_true",
+                        help="Incluir los polígonos en la salida JSONL")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Número de procesos (por defecto, núcleos disponibles)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="Máximo de imágenes en vuelo (por defecto 4 x procesos)")
+    parser.add_argument("-r", "--recursive", action="store_true",
+                        help="Recorrer subdirectorios")
+
+    defaults = DetectionParams()
+    parser.add_argument("--blur-kernel", type=int, default=defaults.blur_kernel)
+    parser.add_argument("--canny-low", type=int, default=defaults.canny_low)
+    parser.add_argument("--canny-high", type=int, default=defaults.canny_high)
+    parser.add_argument("--epsilon-factor", type=float, default=defaults.epsilon_factor)
+    parser.add_argument("--min-area", type=float, default=defaults.min_area)
+    parser.add_argument("--pyramid", action="store_true",
+                        help="Detectar sobre una versión reducida de la imagen")
+    parser.add_argument("--refine", action="store_true",
+                        help="Con --pyramid, volver a medir cada figura a resolución completa")
+    parser.add_argument("--tile-size", type=int, default=None,
+                        help="Procesar cada imagen por mosaicos de este tamaño (px)")
+    parser.add_argument("--tile-overlap", type=int, default=256,
+                        help="Solapamiento entre mosaicos (px)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Directorio de caché de resultados en disco")
+    parser.add_argument("--cache-size-mb", type=int, default=512,
+                        help="Tamaño máximo de la caché en disco (MB)")
+    parser.add_argument("--templates", default=None,
+                        help="Índice .npz o directorio de plantillas para clasificar (ver templates.py)")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="Reutilizar el resultado de imágenes casi idénticas (hash perceptual)")
+    parser.add_argument("--dedupe-index", default=None,
+                        help="Archivo JSONL donde conservar los hashes entre ejecuciones (implica --dedupe)")
+    parser.add_argument("--dedupe-threshold", type=int, default=DEFAULT_THRESHOLD,
+                        help="Bits de diferencia máximos para considerar dos imágenes iguales")
+    return parser
+
+
+def params_from_args(args):
+    return DetectionParams(
+        blur_kernel=args.blur_kernel,
+        canny_low=args.canny_low,
+        canny_high=args.canny_high,
+        epsilon_factor=args.epsilon_factor,
+        min_area=args.min_area,
+        pyramid=args.pyramid,
+        refine=args.refine,
+    )
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    paths = iter_image_paths(args.inputs, recursive=args.recursive)
+
+    if args.format == "npz" and not args.output:
+        print("El formato npz necesita -o/--output", file=sys.stderr)
+        return 2
+
+    classifier = TemplateClassifier.load(args.templates) if args.templates else None
+    exporter = open_exporter(args.format, args.output or sys.stdout,
+                             include_contours=args.contours)
+    try:
+        summary = run_batch(paths, exporter, params_from_args(args),
+                            workers=args.workers, max_in_flight=args.max_in_flight,
+                            tile_size=args.tile_size, overlap=args.tile_overlap,
+                            cache_dir=args.cache_dir, cache_bytes=args.cache_size_mb * 1024 * 1024,
+                            include_contours=args.contours or args.format == "npz",
+                            classifier=classifier, dedupe=args.dedupe,
+                            dedupe_index=args.dedupe_index,
+                            dedupe_threshold=args.dedupe_threshold)
+    finally:
+        exporter.close()
+
+    print(
+        f"Procesadas: {summary['images']} | Fallos: {summary['failed']} | "
+        f"Duplicadas: {summary['duplicates']} | "
+        f"{summary['seconds']:.2f} s | {summary['images_per_sec']:.1f} imágenes/s",
+        file=sys.stderr,
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,423 @@
+"""Benchmark del pipeline de detección con tiempos por etapa.
+
+Uso::
+
+    python benchmark.py -o bench.json                  # matriz completa
+    python benchmark.py --quick -o bench.json          # sólo tamaños pequeños
+    python benchmark.py --baseline bench.json          # comparar y fallar si empeora
+
+Las imágenes se generan con ``crear_imagen_con_figura`` (una figura por celda,
+repetida en rejilla hasta el número pedido) y ``create_test_image`` (escena de
+prueba escalada), con ruido gaussiano opcional. La cifra principal de cada caso
+(``total_ms``) es el tiempo de ``ShapeDetector.detect`` completo, con anotación;
+``pipeline_ms`` son los tiempos por etapa que él mismo registra en
+``DetectionStats`` y ``stages_ms`` un desglose más fino (color, desenfoque,
+Canny, contornos...) que repite el pipeline paso a paso. De todo se guarda la
+mediana de ``--repeat`` repeticiones.
+
+También se mide el tiempo de ``import`` de los módulos principales en
+intérpretes nuevos y se comprueba que ninguno carga Tk ni Pillow al importarse,
+que ``TiledDetector`` encuentra las mismas figuras que ``ShapeDetector`` en
+imágenes de ``generar_dataset``, y que el hash de ``dedupe.py`` une las copias
+recomprimidas, desplazadas o con ruido de una imagen pero no dos imágenes
+distintas (cualquier fallo cuenta como regresión).
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from glob import glob
+from itertools import combinations
+
+import cv2
+import numpy as np
+
+from crear_imagenes_individuales import crear_imagen_con_figura
+from create_test_image import create_test_image
+from dedupe import DEFAULT_THRESHOLD, perceptual_hash
+from detector import (DetectionParams, DetectionResult, ShapeDetector, classify_features,
+                      draw_annotations, extract_features)
+from generar_dataset import generate_image
+from tiled import TiledDetector
+
+
+SIZES = {
+    "vga": (640, 480),
+    "hd": (1280, 720),
+    "fhd": (1920, 1080),
+    "4k": (3840, 2160),
+    "8k": (7680, 4320),
+}
+SHAPE_COUNTS = (1, 10, 100)
+NOISE_LEVELS = (0, 10, 25)
+FORMAS = ("triangulo", "cuadrado", "rectangulo", "pentagono", "hexagono", "circulo")
+
+STAGE_NAMES = ("cvtColor", "blur", "canny", "findContours", "features", "classify", "annotate")
+
+# Etapas más rápidas que esto (ms) no cuentan como regresión: es ruido de medida
+MIN_COMPARABLE_MS = 0.5
+
+# Módulos cuyo tiempo de importación se mide, y módulos de interfaz que ninguno
+# de ellos debe cargar al importarse
+STARTUP_MODULES = ("detector", "batch", "server", "geometric_shape_detector")
+GUI_MODULES = ("tkinter", "PIL.ImageTk")
+
+# (tile_size, overlap) con los que se compara TiledDetector con ShapeDetector,
+# y tamaño de las imágenes de la comparación
+TILED_CHECKS = ((512, 64), (1024, 256))
+TILED_IMAGE_SIZE = (3000, 2000)
+
+_IMPORT_PROBE = """\
+import sys, time
+start = time.perf_counter()
+import {module}
+print((time.perf_counter() - start) * 1000, *[m for m in {gui!r} if m in sys.modules])
+"""
+
+
+def make_grid_image(size, count, noise=0, seed=0):
+    """Rejilla de ``count`` figuras (una por celda) sobre un lienzo de ``size``."""
+    width, height = size
+    cols = max(int(math.ceil(math.sqrt(count * width / height))), 1)
+    rows = int(math.ceil(count / cols))
+    cell = max(min(width // cols, height // rows), 1)
+
+    # Una celda por tipo de figura, generadas una vez y reescaladas
+    cells = [
+        cv2.resize(crear_imagen_con_figura(forma, None), (cell, cell), interpolation=cv2.INTER_AREA)
+        for forma in FORMAS
+    ]
+
+    img = np.full((height, width, 3), 255, dtype=np.uint8)
+    for i in range(count):
+        r, c = divmod(i, cols)
+        img[r * cell:(r + 1) * cell, c * cell:(c + 1) * cell] = cells[i % len(cells)]
+    return add_noise(img, noise, seed)
+
+
+def make_scene_image(size, noise=0, seed=0):
+    """La escena de ``create_test_image`` escalada a ``size``."""
+    img = cv2.resize(create_test_image(), size, interpolation=cv2.INTER_LINEAR)
+    return add_noise(img, noise, seed)
+
+
+def add_noise(img, sigma, seed=0):
+    if not sigma:
+        return img
+    rng = np.random.default_rng(seed)
+    noisy = img.astype(np.int16) + rng.normal(0, sigma, img.shape).astype(np.int16)
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def time_stages(image, params):
+    """Ejecuta el pipeline una vez y devuelve ``(tiempos_ms, n_figuras)``."""
+    p = params
+    times = {}
+
+    def timed(name, fn, *args, **kwargs):
+        start = time.perf_counter()
+        out = fn(*args, **kwargs)
+        times[name] = (time.perf_counter() - start) * 1000
+        return out
+
+    gray = timed("cvtColor", cv2.cvtColor, image, cv2.COLOR_BGR2GRAY)
+    blurred = timed("blur", cv2.GaussianBlur, gray, (p.blur_kernel, p.blur_kernel), 0)
+    edges = timed("canny", cv2.Canny, blurred, p.canny_low, p.canny_high)
+    contours, _ = timed("findContours", cv2.findContours, edges,
+                        cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    features = timed("features", extract_features, contours, p.epsilon_factor, p.min_area)
+    names = timed("classify", classify_features, features)
+    result = DetectionResult.from_features(features, image.shape[:2], names)
+    timed("annotate", draw_annotations, image, result)
+    return times, len(result.shapes)
+
+
+def time_detect(detector, image):
+    """``ShapeDetector.detect`` de principio a fin: ``(ms, DetectionStats, n_figuras)``."""
+    start = time.perf_counter()
+    result = detector.detect(image, annotate=True)
+    return (time.perf_counter() - start) * 1000, result.stats, len(result.shapes)
+
+
+def run_case(name, image, params, repeat):
+    detector = ShapeDetector(params)
+    samples = {stage: [] for stage in STAGE_NAMES}
+    pipeline = {}
+    totals = []
+    detected = 0
+    for _ in range(repeat):
+        ms, stats, detected = time_detect(detector, image)
+        totals.append(ms)
+        for stage, stage_ms in stats.timings.items():
+            pipeline.setdefault(stage, []).append(stage_ms)
+        times, _ = time_stages(image, params)
+        for stage, stage_ms in times.items():
+            samples[stage].append(stage_ms)
+
+    return {
+        "name": name,
+        "size": [image.shape[1], image.shape[0]],
+        "total_ms": round(float(np.median(totals)), 4),
+        "pipeline_ms": {stage: round(float(np.median(v)), 4) for stage, v in pipeline.items()},
+        "stages_ms": {stage: round(float(np.median(v)), 4) for stage, v in samples.items()},
+        "detected": detected,
+    }
+
+
+def measure_import(module, repeat):
+    """Mediana del tiempo de ``import module`` en intérpretes nuevos."""
+    code = _IMPORT_PROBE.format(module=module, gui=GUI_MODULES)
+    samples = []
+    gui = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.split()
+        samples.append(float(out[0]))
+        gui = out[1:]
+    return {"module": module, "import_ms": round(float(np.median(samples)), 3), "gui_modules": gui}
+
+
+def _same_shape(a, b, tol=3):
+    return (a["nombre"] == b["nombre"]
+            and abs(a["centro"][0] - b["centro"][0]) <= tol
+            and abs(a["centro"][1] - b["centro"][1]) <= tol
+            and abs(a["area"] - b["area"]) <= 0.02 * b["area"] + 5)
+
+
+def check_tiled(count, params, checks=TILED_CHECKS, size=TILED_IMAGE_SIZE):
+    """Compara ``TiledDetector`` con ``ShapeDetector`` en ``count`` imágenes generadas.
+
+    Returns:
+        lista de dicts por configuración con las imágenes que difieren.
+    """
+    images = [generate_image(i, seed=1, size=size, max_shapes=400)[0] for i in range(count)]
+    expected = [ShapeDetector(params).detect(img).shapes for img in images]
+    report = []
+    for tile_size, overlap in checks:
+        tiled = TiledDetector(params, tile_size=tile_size, overlap=overlap)
+        mismatches = []
+        for i, (img, full) in enumerate(zip(images, expected)):
+            shapes = list(tiled.detect(img).shapes)
+            missing = 0
+            for shape in full:
+                match = next((j for j, s in enumerate(shapes) if _same_shape(s, shape)), None)
+                if match is None:
+                    missing += 1
+                else:
+                    shapes.pop(match)
+            if missing or shapes:
+                mismatches.append({"image": i, "missing": missing, "extra": len(shapes)})
+        report.append({"tile_size": tile_size, "overlap": overlap, "images": count,
+                       "mismatches": mismatches})
+    return report
+
+
+def _dedupe_copies(img):
+    """Copias de ``img`` que el índice de duplicados debe reconocer: ``(sufijo, imagen, params)``."""
+    shift = np.float32([[1, 0, 2], [0, 1, 2]])
+    shifted = cv2.warpAffine(img, shift, (img.shape[1], img.shape[0]), borderMode=cv2.BORDER_REPLICATE)
+    noisy = add_noise(img, 5, seed=1)
+    return [(".q90.jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90]),
+            (".q70.jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 70]),
+            (".shift.png", shifted, []),
+            (".noise.png", noisy, [])]
+
+
+def check_dedupe(count, threshold=DEFAULT_THRESHOLD):
+    """Distancias del hash perceptual entre copias y entre imágenes distintas.
+
+    Usa las imágenes de ``ejemplos/`` y ``count`` de ``generar_dataset``.
+
+    Returns:
+        dict con la mayor distancia entre copias, la menor entre distintas y
+        los pares que caen del lado equivocado del umbral.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    images = [(os.path.basename(p), cv2.imread(p)) for p in sorted(glob(os.path.join(here, "ejemplos", "*.png")))]
+    images += [(f"dataset-{i}.png", generate_image(i, seed=11, size=(1024, 768), max_shapes=1 + i % 15)[0])
+               for i in range(count)]
+
+    failures = []
+    worst_copy = 0
+    hashes = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, img in images:
+            path = os.path.join(tmp, name)
+            cv2.imwrite(path, img)
+            value, size = perceptual_hash(path)
+            hashes.append((name, value, size))
+            for suffix, copy, flags in _dedupe_copies(img):
+                copy_path = path + suffix
+                cv2.imwrite(copy_path, copy, flags)
+                other, other_size = perceptual_hash(copy_path)
+                dist = bin(value ^ other).count("1")
+                worst_copy = max(worst_copy, dist)
+                if other_size != size or dist > threshold:
+                    failures.append(f"{name}{suffix}: {dist} bits de su original")
+
+    closest = None
+    for (a, va, sa), (b, vb, sb) in combinations(hashes, 2):
+        if sa != sb:
+            continue
+        dist = bin(va ^ vb).count("1")
+        closest = dist if closest is None else min(closest, dist)
+        if dist <= threshold:
+            failures.append(f"{a} y {b}: distintas pero a {dist} bits")
+    return {"images": len(images), "threshold": threshold, "max_copy_bits": worst_copy,
+            "min_distinct_bits": closest, "failures": failures}
+
+
+def iter_cases(sizes, counts, noises):
+    for size_name in sizes:
+        size = SIZES[size_name]
+        for noise in noises:
+            for count in counts:
+                yield f"grid-{size_name}-n{count}-s{noise}", make_grid_image(size, count, noise)
+            yield f"scene-{size_name}-s{noise}", make_scene_image(size, noise)
+
+
+def compare(current, baseline, tolerance):
+    """Devuelve una lista de mensajes de regresión frente a ``baseline``."""
+    previous = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+
+    old_startup = {entry["module"]: entry for entry in baseline.get("startup", ())}
+    for entry in current.get("startup", ()):
+        if entry["gui_modules"]:
+            regressions.append(f"import {entry['module']}: carga {', '.join(entry['gui_modules'])}")
+        old = old_startup.get(entry["module"])
+        if old is None or max(entry["import_ms"], old["import_ms"]) < MIN_COMPARABLE_MS:
+            continue
+        if entry["import_ms"] > old["import_ms"] * (1 + tolerance):
+            regressions.append(
+                f"import {entry['module']}: {old['import_ms']:.1f} ms -> {entry['import_ms']:.1f} ms"
+            )
+
+    for failure in current.get("dedupe", {}).get("failures", ()):
+        regressions.append(f"dedupe {failure}")
+
+    for entry in current.get("tiled", ()):
+        for m in entry["mismatches"]:
+            regressions.append(
+                f"mosaico {entry['tile_size']}/{entry['overlap']} imagen {m['image']}: "
+                f"{m['missing']} figuras perdidas, {m['extra']} de más"
+            )
+
+    for case in current["cases"]:
+        old = previous.get(case["name"])
+        if old is None:
+            continue
+        checks = [("total", case["total_ms"], old["total_ms"])]
+        checks += [(f"detect:{stage}", ms, old.get("pipeline_ms", {}).get(stage))
+                   for stage, ms in case["pipeline_ms"].items()]
+        checks += [(stage, ms, old["stages_ms"].get(stage)) for stage, ms in case["stages_ms"].items()]
+        for label, new_ms, old_ms in checks:
+            if old_ms is None or max(new_ms, old_ms) < MIN_COMPARABLE_MS:
+                continue
+            if new_ms > old_ms * (1 + tolerance):
+                regressions.append(
+                    f"{case['name']} [{label}]: {old_ms:.2f} ms -> {new_ms:.2f} ms "
+                    f"(+{(new_ms / old_ms - 1) * 100:.0f}%)"
+                )
+        if case["detected"] != old["detected"]:
+            regressions.append(
+                f"{case['name']}: figuras detectadas {old['detected']} -> {case['detected']}"
+            )
+    return regressions
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Benchmark del detector de figuras.")
+    parser.add_argument("-o", "--output", help="Archivo JSON de resultados (por defecto stdout)")
+    parser.add_argument("--baseline", help="JSON previo con el que comparar")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Empeoramiento relativo admitido antes de fallar (0.2 = 20%%)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="Sólo VGA y HD")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=None)
+    parser.add_argument("--counts", nargs="+", type=int, default=list(SHAPE_COUNTS))
+    parser.add_argument("--noise", nargs="+", type=int, default=list(NOISE_LEVELS))
+    parser.add_argument("--no-startup", action="store_true",
+                        help="No medir el tiempo de importación de los módulos")
+    parser.add_argument("--dedupe-images", type=int, default=20,
+                        help="Imágenes generadas con las que comprobar el hash de duplicados (0 = no)")
+    parser.add_argument("--tiled-images", type=int, default=4,
+                        help="Imágenes con las que comparar TiledDetector y ShapeDetector (0 = no)")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    sizes = args.sizes or (["vga", "hd"] if args.quick else list(SIZES))
+    params = DetectionParams()
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "repeat": args.repeat,
+        },
+        "startup": [],
+        "dedupe": {},
+        "tiled": [],
+        "cases": [],
+    }
+    if not args.no_startup:
+        for module in STARTUP_MODULES:
+            entry = measure_import(module, args.repeat)
+            report["startup"].append(entry)
+            gui = f"  (carga {', '.join(entry['gui_modules'])})" if entry["gui_modules"] else ""
+            print(f"import {module:<24} {entry['import_ms']:>10.2f} ms{gui}", file=sys.stderr)
+
+    if args.dedupe_images:
+        report["dedupe"] = check_dedupe(args.dedupe_images)
+        dedupe = report["dedupe"]
+        print(f"dedupe: copias a {dedupe['max_copy_bits']} bits como mucho, distintas a "
+              f"{dedupe['min_distinct_bits']} como poco (umbral {dedupe['threshold']})", file=sys.stderr)
+        for failure in dedupe["failures"]:
+            print(f"  {failure}", file=sys.stderr)
+
+    if args.tiled_images:
+        report["tiled"] = check_tiled(args.tiled_images, params)
+        for entry in report["tiled"]:
+            print(f"mosaico {entry['tile_size']}/{entry['overlap']:<18} "
+                  f"{len(entry['mismatches'])} de {entry['images']} imágenes difieren", file=sys.stderr)
+
+    for name, image in iter_cases(sizes, args.counts, args.noise):
+        case = run_case(name, image, params, args.repeat)
+        report["cases"].append(case)
+        print(f"{name:<28} {case['total_ms']:>10.2f} ms  ({case['detected']} figuras)", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("\nREGRESIONES DE RENDIMIENTO:", file=sys.stderr)
+            for line in regressions:
+                print("  " + line, file=sys.stderr)
+            return 1
+        print("\nSin regresiones frente a la línea base.", file=sys.stderr)
+    elif report["dedupe"].get("failures") or any(entry["mismatches"] for entry in report["tiled"]):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
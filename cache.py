@@ -0,0 +1,199 @@
+"""Caché de resultados direccionada por contenido.
+
+La clave es un hash de los bytes de la imagen (más forma y tipo) y de los
+``DetectionParams``. Hay dos niveles:
+
+* memoria: LRU con un número máximo de entradas;
+* disco (opcional): un ``.npz`` por entrada con desalojo de los menos usados
+  cuando el directorio supera ``max_bytes``.
+
+Un acierto reconstruye el ``DetectionResult`` (figuras, contornos y, si se
+guardó, la imagen anotada) sin llamar a OpenCV.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from collections import OrderedDict
+from dataclasses import astuple
+
+import numpy as np
+
+from detector import DetectionResult
+
+
+def cache_key(image, params):
+    """Hash estable de la imagen y los parámetros de detección."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((image.shape, image.dtype.str, astuple(params))).encode())
+    h.update(np.ascontiguousarray(image).data)
+    return h.hexdigest()
+
+
+def _copy_result(result):
+    """Copia superficial para que quien llama pueda modificar las figuras."""
+    return DetectionResult(
+        shapes=[dict(s) for s in result.shapes],
+        contours=list(result.contours),
+        image_size=result.image_size,
+        annotated=result.annotated,
+        pyramid_level=result.pyramid_level,
+    )
+
+
+class ResultCache:
+    """Caché LRU en memoria con un nivel opcional en disco."""
+
+    def __init__(self, max_entries=64, cache_dir=None, max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._disk_bytes = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    key = staticmethod(cache_key)
+
+    def get(self, key, annotated=False):
+        """Devuelve el resultado guardado o ``None``.
+
+        Con ``annotated=True`` sólo cuenta como acierto una entrada que tenga la
+        imagen anotada.
+        """
+        result = self._memory.get(key)
+        if result is not None and (not annotated or result.annotated is not None):
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return _copy_result(result)
+
+        if self.cache_dir:
+            result = self._load(key, annotated)
+            if result is not None:
+                self._remember(key, result)
+                self.hits += 1
+                return _copy_result(result)
+
+        self.misses += 1
+        return None
+
+    def put(self, key, result):
+        self._remember(key, result)
+        if self.cache_dir:
+            self._store(key, result)
+
+    def clear(self):
+        self._memory.clear()
+
+    def _remember(self, key, result):
+        self._memory[key] = _copy_result(result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    # -- nivel en disco -------------------------------------------------
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def _load(self, key, annotated):
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if annotated and "annotated" not in data:
+                    return None
+                shapes = json.loads(str(data["shapes"]))
+                points = data["points"]
+                offsets = data["offsets"]
+                result = DetectionResult(
+                    shapes=[dict(s, centro=tuple(s["centro"])) for s in shapes],
+                    contours=[points[a:b] for a, b in zip(offsets[:-1], offsets[1:])],
+                    image_size=tuple(int(v) for v in data["image_size"]),
+                    annotated=data["annotated"] if "annotated" in data else None,
+                    pyramid_level=int(data["pyramid_level"]),
+                )
+        except FileNotFoundError:
+            return None
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            # Entrada dañada (p. ej. truncada): cuenta como fallo y se borra
+            self._discard(path)
+            return None
+        # Marcar como usado recientemente para el desalojo
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return result
+
+    def _discard(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        # Recalcular el tamaño del directorio en la próxima escritura
+        self._disk_bytes = None
+
+    def _store(self, key, result):
+        contours = [np.asarray(c, dtype=np.int32).reshape(-1, 1, 2) for c in result.contours]
+        offsets = np.cumsum([0] + [len(c) for c in contours])
+        arrays = {
+            "shapes": np.array(json.dumps([
+                dict(s, area=float(s["area"]), vertices=int(s["vertices"]),
+                     centro=[int(v) for v in s["centro"]])
+                for s in result.shapes
+            ], ensure_ascii=False)),
+            "points": np.concatenate(contours) if contours else np.empty((0, 1, 2), np.int32),
+            "offsets": offsets,
+            "image_size": np.array(result.image_size),
+            "pyramid_level": np.array(result.pyramid_level),
+        }
+        if result.annotated is not None:
+            arrays["annotated"] = result.annotated
+
+        # Escritura atómica para que otros procesos nunca lean un archivo a medias
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+
+        if self._disk_bytes is None:
+            self._disk_bytes = self._scan_disk()[1]
+        else:
+            self._disk_bytes += os.path.getsize(self._path(key))
+        if self._disk_bytes > self.max_bytes:
+            self._evict()
+
+    def _scan_disk(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npz"):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        return entries, total
+
+    def _evict(self):
+        """Borra las entradas menos usadas hasta quedar por debajo de ``max_bytes``."""
+        entries, total = self._scan_disk()
+        entries.sort()
+        for _mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
@@ -6,7 +6,7 @@ def crear_imagen_con_figura(forma, nombre_archivo, tamaño=(600, 600)):
     """
     Args:
         forma: tipo de figura ('triangulo', 'cuadrado', 'rectangulo', 'pentagono', 'hexagono', 'circulo')
-        nombre_archivo: nombre del archivo de salida
+        nombre_archivo: nombre del archivo de salida (None para no guardarla)
         tamaño: tupla con (ancho, alto) de la imagen
     """
     # Crear imagen blanca
@@ -84,8 +84,9 @@ def crear_imagen_con_figura(forma, nombre_archivo, tamaño=(600, 600)):
         cv2.circle(img, (centro_x, centro_y), radio, (0, 0, 0), 2)
     
     # Guardar la imagen
-    cv2.imwrite(nombre_archivo, img)
-    print(f"✓ Creada: {nombre_archivo}")
+    if nombre_archivo is not None:
+        cv2.imwrite(nombre_archivo, img)
+        print(f"✓ Creada: {nombre_archivo}")
     
     return img
 
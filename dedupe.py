@@ -0,0 +1,175 @@
+"""Detección de imágenes casi duplicadas mediante hash perceptual.
+
+``perceptual_hash`` parte de una decodificación reducida a 1/8 en escala de
+grises (mucho más barata que detectar), la lleva a 64×64 y calcula su DCT. Cada
+bit del hash dice si uno de los 32×32 coeficientes de menor frecuencia queda
+claramente por encima de la mediana: a más de ``DEAD_ZONE`` veces la desviación
+media. ``PerceptualIndex`` guarda los hashes junto con el registro de detección
+de cada imagen y, si se le da una ruta, los añade a un archivo JSONL que se
+vuelve a cargar en la siguiente ejecución.
+
+El pHash habitual (signo de 8×8 coeficientes frente a la mediana) no sirve aquí:
+en imágenes de pocas figuras sobre fondo liso, y más si son simétricas como las
+de ``ejemplos/``, muchos coeficientes son casi cero y su bit lo decide el ruido.
+Así, volver a comprimir un JPEG lo cambia en 30 bits, y dos imágenes distintas
+pueden quedar a 3. Con el margen ``DEAD_ZONE`` esos coeficientes dan siempre 0,
+y el bloque de 32×32 conserva detalle suficiente para separar figuras parecidas.
+
+Dos imágenes se consideran la misma si su tamaño reducido coincide (así las
+coordenadas del resultado siguen valiendo) y sus hashes difieren en como mucho
+``threshold`` bits. Medido en ``ejemplos/`` y en imágenes de ``generar_dataset``,
+dos imágenes distintas quedan a 47 bits o más. Una copia en JPEG de calidad
+70-90 o con ruido gaussiano de sigma 5 queda a 36 o menos, y una desplazada
+2 px queda a 33 o menos en el 99 % de los casos (``benchmark.py`` lo comprueba).
+"""
+import json
+import os
+
+import cv2
+import numpy as np
+
+
+# Lado de la imagen sobre la que se calcula la DCT y del bloque de
+# coeficientes que forma el hash
+DCT_SIDE = 64
+HASH_SIDE = 32
+HASH_BYTES = HASH_SIDE * HASH_SIDE // 8
+
+# Un coeficiente sólo da 1 si supera la mediana en este múltiplo de la
+# desviación media
+DEAD_ZONE = 2.0
+
+DEFAULT_THRESHOLD = 40
+
+# Bits a 1 de cada byte, para la distancia de Hamming vectorizada
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def perceptual_hash(path):
+    """Hash perceptual de ``path``.
+
+    Returns:
+        ``(hash, (alto, ancho) reducidos)`` o ``(None, None)`` si no se puede leer.
+    """
+    small = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if small is None:
+        return None, None
+    tiny = cv2.resize(small, (DCT_SIDE, DCT_SIDE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(tiny)[:HASH_SIDE, :HASH_SIDE].ravel()
+    # El coeficiente de continua sólo mide el brillo medio: no entra en la mediana
+    dev = low - np.median(low[1:])
+    bits = dev > DEAD_ZONE * np.abs(dev[1:]).mean()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big"), tuple(small.shape[:2])
+
+
+def _hash_bytes(value):
+    return np.frombuffer(int(value).to_bytes(HASH_BYTES, "big"), dtype=np.uint8)
+
+
+def hamming_distances(hashes, value):
+    """Distancia de Hamming entre cada fila de ``hashes`` (``(N, HASH_BYTES)`` bytes) y ``value``."""
+    diff = np.bitwise_xor(hashes, _hash_bytes(value))
+    return _POPCOUNT[diff].sum(axis=1, dtype=np.int64)
+
+
+def _to_json(record):
+    record = {k: v for k, v in record.items() if k not in ("seconds", "stats")}
+    if "contours" in record:
+        record["contours"] = [np.asarray(c).reshape(-1, 2).tolist() for c in record["contours"]]
+    return record
+
+
+class PerceptualIndex:
+    """Hashes perceptuales con el registro de detección de cada imagen.
+
+    Una entrada puede estar pendiente (añadida sin registro mientras se detecta)
+    para que las imágenes casi iguales que llegan mientras tanto esperen a su
+    resultado en lugar de detectarse también. Sólo se cargan y comparan entradas
+    con el mismo ``settings`` (parámetros de detección, clasificador...).
+    """
+
+    def __init__(self, path=None, settings="", threshold=DEFAULT_THRESHOLD):
+        self.path = path
+        self.settings = settings
+        self.threshold = threshold
+        self._hashes = np.empty((64, HASH_BYTES), dtype=np.uint8)
+        # Tamaño reducido (alto, ancho) de cada entrada; -1 si está anulada
+        self._sizes = np.empty((64, 2), dtype=np.int64)
+        self._records = []
+        self._file = None
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    # Los hashes de otro tamaño son de una versión anterior
+                    if entry.get("settings") == settings and len(entry["hash"]) == 2 * HASH_BYTES:
+                        pos = self.add(int(entry["hash"], 16), entry["size"])
+                        self._records[pos] = entry["record"]
+        if path:
+            self._file = open(path, "a", encoding="utf-8")
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, value, size, record=None):
+        """Añade una entrada (pendiente si ``record`` es ``None``) y devuelve su posición."""
+        n = len(self._records)
+        if n == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.empty_like(self._hashes)])
+            self._sizes = np.concatenate([self._sizes, np.empty_like(self._sizes)])
+        self._hashes[n] = _hash_bytes(value)
+        self._sizes[n] = size
+        self._records.append(None)
+        if record is not None:
+            self.resolve(n, record)
+        return n
+
+    def find(self, value, size):
+        """Posición de la entrada más parecida dentro del umbral, o ``None``."""
+        n = len(self._records)
+        if not n:
+            return None
+        dist = hamming_distances(self._hashes[:n], value)
+        same = (self._sizes[:n] == size).all(axis=1)
+        dist[~same] = np.iinfo(dist.dtype).max
+        best = int(np.argmin(dist))
+        return best if dist[best] <= self.threshold else None
+
+    def record(self, pos):
+        """Registro de la entrada ``pos`` o ``None`` si aún está pendiente."""
+        return self._records[pos]
+
+    def resolve(self, pos, record):
+        """Completa una entrada pendiente y la guarda en disco."""
+        record = _to_json(record)
+        self._records[pos] = record
+        if self._file is not None:
+            self._file.write(json.dumps({
+                "settings": self.settings,
+                "hash": self._hashes[pos].tobytes().hex(),
+                "size": self._sizes[pos].tolist(),
+                "record": record,
+            }, ensure_ascii=False) + "\n")
+
+    def discard(self, pos):
+        """Anula una entrada (p. ej. una detección fallida) para que no coincida más."""
+        self._sizes[pos] = -1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def duplicate_record(record, path):
+    """Registro de ``path`` reutilizando la detección de ``record``."""
+    out = {k: v for k, v in record.items() if k not in ("seconds", "stats")}
+    out["path"] = path
+    out["duplicate_of"] = record["path"]
+    return out
@@ -0,0 +1,677 @@
+"""Motor de detección de figuras geométricas sin dependencias de interfaz gráfica.
+
+Este módulo contiene el pipeline completo (escala de grises, desenfoque, Canny,
+contornos y clasificación) para que pueda usarse desde la aplicación Tk, desde
+scripts por lotes o desde servicios sin pantalla.
+"""
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+
+import cv2
+import numpy as np
+
+from spatial import ShapeIndex
+
+
+# Colores BGR por tipo de figura
+SHAPE_COLORS = {
+    "Triangulo": (0, 255, 0),      # Verde
+    "Cuadrado": (255, 0, 0),       # Azul
+    "Rectangulo": (0, 165, 255),   # Naranja
+    "Pentagono": (255, 0, 255),    # Magenta
+    "Hexagono": (255, 255, 0),     # Cian
+    "Circulo": (0, 0, 255),        # Rojo
+}
+DEFAULT_COLOR = (255, 255, 255)  # Blanco por defecto
+
+# Etapas del pipeline en el orden en que se notifican a ``progress``
+STAGES = ("gris", "desenfoque", "bordes", "contornos", "clasificacion", "anotacion")
+
+
+# Modo pirámide: nivel más reducido en el que una figura de ``min_area`` sigue
+# ocupando al menos PYRAMID_MIN_LEVEL_AREA px² y la imagen al menos
+# PYRAMID_MIN_SIDE px en su lado mayor.
+PYRAMID_MIN_LEVEL_AREA = 120
+PYRAMID_MIN_SIDE = 512
+PYRAMID_MAX_LEVEL = 4
+
+# Decodificación directa a grises, completa o reducida por 2, 4 u 8
+GRAYSCALE_DECODE_MODES = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+class DetectionCancelled(Exception):
+    """Se lanza cuando una detección en curso es cancelada."""
+
+
+@dataclass(frozen=True)
+class DetectionParams:
+    """Parámetros configurables del pipeline de detección."""
+    blur_kernel: int = 5
+    canny_low: int = 50
+    canny_high: int = 150
+    epsilon_factor: float = 0.04
+    min_area: float = 500
+    # Detectar sobre un nivel reducido de la pirámide (ver choose_pyramid_level)
+    pyramid: bool = False
+    # En modo pirámide, volver a medir cada figura a resolución completa
+    # dentro de su rectángulo envolvente
+    refine: bool = False
+    # Con máscaras binarias (sólo 0 y 255) buscar contornos directamente, sin
+    # desenfoque ni Canny
+    mask_shortcut: bool = True
+
+
+@dataclass
+class DetectionStats:
+    """Tiempos y contadores de una ejecución del pipeline.
+
+    ``timings`` guarda milisegundos por etapa de ``STAGES``; ``bytes_allocated``
+    suma los búferes intermedios que crea el pipeline (grises, pirámide,
+    desenfoque, bordes, contornos e imagen anotada).
+    """
+    timings: dict = field(default_factory=dict)
+    contours_found: int = 0
+    contours_filtered: int = 0
+    shapes_per_class: dict = field(default_factory=dict)
+    bytes_allocated: int = 0
+    cache_hit: bool = False
+
+    @property
+    def total_ms(self):
+        return sum(self.timings.values())
+
+    def as_dict(self):
+        data = asdict(self)
+        data["timings"] = {k: round(v, 3) for k, v in self.timings.items()}
+        data["total_ms"] = round(self.total_ms, 3)
+        return data
+
+    def summary(self):
+        """Resumen de una línea para la barra de estado."""
+        if self.cache_hit:
+            return f"{self.total_ms:.1f} ms (caché)"
+        slowest = max(self.timings, key=self.timings.get) if self.timings else "-"
+        return (
+            f"{self.total_ms:.1f} ms (más lenta: {slowest} "
+            f"{self.timings.get(slowest, 0):.1f} ms) · {self.contours_found} contornos, "
+            f"{self.contours_filtered} descartados · {self.bytes_allocated / 1e6:.1f} MB"
+        )
+
+
+@dataclass
+class DetectionResult:
+    """Resultado estructurado de una detección.
+
+    ``shapes`` mantiene el formato histórico de ``shapes_list`` (numero, nombre,
+    area, vertices, centro) y ``contours`` guarda el polígono aproximado de cada
+    figura en el mismo orden.
+    """
+    shapes: list = field(default_factory=list)
+    contours: list = field(default_factory=list)
+    image_size: tuple = (0, 0)
+    annotated: np.ndarray = None
+    pyramid_level: int = 0
+    stats: DetectionStats = None
+    _index: ShapeIndex = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def index(self):
+        """``ShapeIndex`` sobre ``contours``, construido en el primer uso."""
+        if self._index is None:
+            self._index = ShapeIndex(self.contours)
+        return self._index
+
+    def query_region(self, x, y, w, h, contained=False):
+        """Figuras de ``shapes`` cuyo rectángulo corta (o con ``contained``,
+        contiene entero) el rectángulo ``(x, y, w, h)``."""
+        return [self.shapes[i] for i in self.index.query_region(x, y, w, h, contained).tolist()]
+
+    def shape_at(self, x, y, tolerance=0.0):
+        """Figura de ``shapes`` bajo el punto ``(x, y)`` o ``None``."""
+        i = self.index.shape_at(x, y, tolerance)
+        return None if i is None else self.shapes[i]
+
+    @classmethod
+    def from_features(cls, features, image_size, names=None):
+        """Construye el resultado a partir de ``ContourFeatures`` ya clasificadas."""
+        if names is None:
+            names = classify_features(features)
+        result = cls(image_size=tuple(image_size))
+        for i, name in enumerate(names):
+            result.shapes.append({
+                'numero': i + 1,
+                'nombre': name,
+                'area': float(features.area[i]),
+                'vertices': int(features.vertices[i]),
+                'centro': (int(features.centroid[i, 0]), int(features.centroid[i, 1]))
+            })
+        result.contours = list(features.approx)
+        return result
+
+
+@dataclass
+class ContourFeatures:
+    """Medidas de un conjunto de contornos, una posición por contorno.
+
+    Todas las columnas son arreglos NumPy de longitud N salvo ``approx``, que es
+    una lista con el polígono aproximado de cada contorno.
+    """
+    area: np.ndarray
+    perimeter: np.ndarray
+    centroid: np.ndarray      # (N, 2) int, (cX, cY)
+    bbox: np.ndarray          # (N, 4) int, (x, y, w, h) del polígono aproximado
+    vertices: np.ndarray
+    circularity: np.ndarray
+    approx: list
+
+    def __len__(self):
+        return len(self.area)
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            area=np.empty(0, dtype=np.float64),
+            perimeter=np.empty(0, dtype=np.float64),
+            centroid=np.empty((0, 2), dtype=np.int64),
+            bbox=np.empty((0, 4), dtype=np.int64),
+            vertices=np.empty(0, dtype=np.int64),
+            circularity=np.empty(0, dtype=np.float64),
+            approx=[],
+        )
+
+    @classmethod
+    def concat(cls, parts):
+        """Une varios ``ContourFeatures`` en uno solo, respetando el orden."""
+        parts = [f for f in parts if len(f)]
+        if not parts:
+            return cls.empty()
+        return cls(
+            area=np.concatenate([f.area for f in parts]),
+            perimeter=np.concatenate([f.perimeter for f in parts]),
+            centroid=np.concatenate([f.centroid for f in parts]),
+            bbox=np.concatenate([f.bbox for f in parts]),
+            vertices=np.concatenate([f.vertices for f in parts]),
+            circularity=np.concatenate([f.circularity for f in parts]),
+            approx=[a for f in parts for a in f.approx],
+        )
+
+    def take(self, indices):
+        """Devuelve sólo las filas indicadas (índices o máscara booleana)."""
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        return ContourFeatures(
+            area=self.area[indices],
+            perimeter=self.perimeter[indices],
+            centroid=self.centroid[indices],
+            bbox=self.bbox[indices],
+            vertices=self.vertices[indices],
+            circularity=self.circularity[indices],
+            approx=[self.approx[i] for i in indices.tolist()],
+        )
+
+    def shifted(self, dx, dy):
+        """Traslada coordenadas (p. ej. de un recorte a la imagen completa)."""
+        offset = np.array([dx, dy], dtype=np.int64)
+        bbox = self.bbox.copy()
+        bbox[:, :2] += offset
+        return ContourFeatures(
+            area=self.area,
+            perimeter=self.perimeter,
+            centroid=self.centroid + offset,
+            bbox=bbox,
+            vertices=self.vertices,
+            circularity=self.circularity,
+            approx=[a + offset.astype(a.dtype) for a in self.approx],
+        )
+
+    def scaled(self, factor):
+        """Escala coordenadas y medidas por ``factor`` (circularidad y vértices no cambian)."""
+        return ContourFeatures(
+            area=self.area * factor * factor,
+            perimeter=self.perimeter * factor,
+            centroid=self.centroid * factor,
+            bbox=self.bbox * factor,
+            vertices=self.vertices,
+            circularity=self.circularity,
+            approx=[a * factor for a in self.approx],
+        )
+
+    @property
+    def aspect_ratio(self):
+        w = self.bbox[:, 2].astype(np.float64)
+        h = self.bbox[:, 3].astype(np.float64)
+        return np.divide(w, h, out=np.zeros_like(w), where=h != 0)
+
+
+def extract_features(contours, epsilon_factor, min_area=0, cancel=None):
+    """Mide cada contorno una sola vez y descarta los de área menor a ``min_area``.
+
+    El filtro usa ``cv2.contourArea``, unas diez veces más barato que
+    ``cv2.moments``; momentos (para el centro), perímetro, aproximación y
+    rectángulo sólo se calculan para los contornos que lo superan. ``cancel``
+    funciona igual que en ``ShapeDetector.detect``.
+    """
+    n = len(contours)
+    areas = np.empty(n, dtype=np.float64)
+    for i, contour in enumerate(contours):
+        # Revisar la cancelación periódicamente en imágenes con muchos contornos
+        if cancel is not None and i % 256 == 0 and cancel.is_set():
+            raise DetectionCancelled("clasificacion")
+        areas[i] = cv2.contourArea(contour)
+
+    keep = np.flatnonzero(areas >= min_area)
+    area = areas[keep]
+
+    m = len(keep)
+    moments = np.empty((m, 2), dtype=np.float64)
+    perimeter = np.empty(m, dtype=np.float64)
+    vertices = np.empty(m, dtype=np.int64)
+    bbox = np.empty((m, 4), dtype=np.int64)
+    approx_list = []
+    for j, i in enumerate(keep):
+        contour = contours[i]
+        M = cv2.moments(contour)
+        moments[j] = (M["m10"], M["m01"])
+        perimeter[j] = cv2.arcLength(contour, True)
+        approx = cv2.approxPolyDP(contour, epsilon_factor * perimeter[j], True)
+        approx_list.append(approx)
+        vertices[j] = len(approx)
+        bbox[j] = cv2.boundingRect(approx)
+
+    # Centro del contorno (0, 0 si el área es nula), truncado como int()
+    nonzero = area != 0
+    centroid = np.zeros((m, 2), dtype=np.int64)
+    centroid[nonzero, 0] = (moments[nonzero, 0] / area[nonzero]).astype(np.int64)
+    centroid[nonzero, 1] = (moments[nonzero, 1] / area[nonzero]).astype(np.int64)
+
+    circularity = np.divide(
+        4 * np.pi * area, perimeter * perimeter,
+        out=np.zeros_like(area), where=perimeter != 0
+    )
+
+    return ContourFeatures(
+        area=area,
+        perimeter=perimeter,
+        centroid=centroid,
+        bbox=bbox,
+        vertices=vertices,
+        circularity=circularity,
+        approx=approx_list,
+    )
+
+
+# Códigos de clase usados por classify_features
+_CLASS_NAMES = ("Figura desconocida", "Triangulo", "Cuadrado", "Rectangulo",
+                "Pentagono", "Hexagono", "Circulo", None)
+_POLYGON = len(_CLASS_NAMES) - 1
+
+
+def classify_features(features):
+    """Aplica las reglas de ``identify_shape`` sobre todas las figuras a la vez."""
+    v = features.vertices
+    ar = features.aspect_ratio
+    circ = features.circularity
+
+    codes = np.select(
+        [
+            v == 3,
+            (v == 4) & (ar >= 0.95) & (ar <= 1.05),
+            v == 4,
+            v == 5,
+            v == 6,
+            (v > 6) & (circ > 0.8),
+            v > 6,
+        ],
+        [1, 2, 3, 4, 5, 6, _POLYGON],
+        default=0,
+    )
+
+    return [
+        f"Poligono ({n} lados)" if code == _POLYGON else _CLASS_NAMES[code]
+        for code, n in zip(codes.tolist(), v.tolist())
+    ]
+
+
+def choose_pyramid_level(image_shape, min_area):
+    """Elige cuántas veces reducir a la mitad la imagen antes de detectar.
+
+    Cada nivel divide el área de una figura entre 4, así que se baja mientras la
+    figura más pequeña aceptada siga teniendo PYRAMID_MIN_LEVEL_AREA px² y el
+    lado mayor de la imagen no baje de PYRAMID_MIN_SIDE.
+    """
+    longest = max(image_shape[:2])
+    level = 0
+    while (level < PYRAMID_MAX_LEVEL
+           and min_area / 4 ** (level + 1) >= PYRAMID_MIN_LEVEL_AREA
+           and longest / 2 ** (level + 1) >= PYRAMID_MIN_SIDE):
+        level += 1
+    return level
+
+
+def choose_decode_factor(min_area):
+    """Reducción (1, 2, 4 u 8) con la que decodificar para el modo pirámide.
+
+    Sigue el mismo criterio de área que ``choose_pyramid_level``; el tamaño de
+    la imagen no se conoce antes de decodificar, así que el lado mínimo se
+    comprueba después (ver ``_decode_gray``).
+    """
+    factor = 1
+    while factor < max(GRAYSCALE_DECODE_MODES) and min_area / (2 * factor) ** 2 >= PYRAMID_MIN_LEVEL_AREA:
+        factor *= 2
+    return factor
+
+
+def _decode_gray(decode, params):
+    params = params or DetectionParams()
+    # ``refine`` necesita la imagen completa para volver a medir
+    factor = choose_decode_factor(params.min_area) if params.pyramid and not params.refine else 1
+    while True:
+        gray = decode(GRAYSCALE_DECODE_MODES[factor])
+        if gray is None or factor == 1 or max(gray.shape) >= PYRAMID_MIN_SIDE:
+            return gray, factor
+        # Imagen pequeña: reducir menos
+        factor //= 2
+
+
+def read_for_detection(path, params=None):
+    """Lee ``path`` directamente en escala de grises para ``ShapeDetector.detect``.
+
+    En modo pirámide (sin ``refine``) se usa la decodificación reducida de
+    OpenCV en lugar de decodificar a tamaño completo y reducir después.
+
+    Returns:
+        ``(imagen en grises o None, factor)``; pásese ``scale=factor`` a ``detect``.
+    """
+    return _decode_gray(lambda flags: cv2.imread(path, flags), params)
+
+
+def decode_for_detection(buffer, params=None):
+    """Como ``read_for_detection`` pero a partir de los bytes del archivo."""
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    return _decode_gray(lambda flags: cv2.imdecode(data, flags), params)
+
+
+def is_binary_mask(gray):
+    """``True`` si la imagen en grises sólo contiene los valores 0 y 255."""
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
+    return not hist[1:255].any()
+
+
+def mask_contours(mask):
+    """Contornos externos de una máscara binaria.
+
+    El fondo es el valor mayoritario en el borde de la imagen (primera y última
+    filas y columnas), no en toda ella: una figura puede ocupar más de la mitad
+    del encuadre.
+    """
+    border = np.concatenate((mask[0], mask[-1], mask[1:-1, 0], mask[1:-1, -1]))
+    if np.count_nonzero(border) * 2 > border.size:
+        mask = cv2.bitwise_not(mask)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
+def identify_shape(vertices, contour=None, approx=None, aspect_ratio=None, circularity=None):
+    """Identifica el tipo de figura según sus características
+
+    Si se pasan ``aspect_ratio`` o ``circularity`` ya medidos se usan tal cual;
+    si no, se calculan a partir de ``approx`` y ``contour``.
+    """
+    if vertices == 3:
+        return "Triangulo"
+
+    elif vertices == 4:
+        # Verificar si es cuadrado o rectángulo
+        if aspect_ratio is None:
+            x, y, w, h = cv2.boundingRect(approx)
+            aspect_ratio = float(w) / h
+
+        if 0.95 <= aspect_ratio <= 1.05:
+            return "Cuadrado"
+        else:
+            return "Rectangulo"
+
+    elif vertices == 5:
+        return "Pentagono"
+
+    elif vertices == 6:
+        return "Hexagono"
+
+    elif vertices > 6:
+        # Verificar si es un círculo
+        if circularity is None:
+            area = cv2.contourArea(contour)
+            perimeter = cv2.arcLength(contour, True)
+            circularity = 4 * np.pi * area / (perimeter * perimeter)
+
+        if circularity > 0.8:
+            return "Circulo"
+        else:
+            return f"Poligono ({vertices} lados)"
+
+    return "Figura desconocida"
+
+
+def get_color_for_shape(shape_name):
+    """Asigna un color específico a cada tipo de figura"""
+    return SHAPE_COLORS.get(shape_name, DEFAULT_COLOR)
+
+
+def draw_annotations(image, result):
+    """Devuelve una copia de ``image`` con contornos, números y nombres dibujados."""
+    annotated = image.copy()
+    if annotated.ndim == 2:
+        annotated = cv2.cvtColor(annotated, cv2.COLOR_GRAY2BGR)
+
+    for shape, approx in zip(result.shapes, result.contours):
+        color = get_color_for_shape(shape['nombre'])
+        cX, cY = shape['centro']
+        cv2.drawContours(annotated, [approx], -1, color, 3)
+
+        # Añadir número de figura
+        cv2.putText(
+            annotated,
+            f"#{shape['numero']}",
+            (cX - 20, cY - 20),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.8,
+            color,
+            2
+        )
+
+        # Añadir texto con el nombre de la figura
+        cv2.putText(
+            annotated,
+            shape['nombre'],
+            (cX - 40, cY + 20),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.6,
+            color,
+            2
+        )
+
+    return annotated
+
+
+class ShapeDetector:
+    """Detector de figuras independiente de la interfaz gráfica."""
+
+    def __init__(self, params=None, cache=None, classifier=None):
+        self.params = params or DetectionParams()
+        # Caché opcional de resultados (p. ej. cache.ResultCache)
+        self.cache = cache
+        # Clasificador opcional con ``classify(features)`` y ``digest`` (p. ej.
+        # templates.TemplateClassifier); sin él se usa ``classify_features``
+        self.classifier = classifier
+
+    def classify(self, features):
+        if self.classifier is not None:
+            return self.classifier.classify(features)
+        return classify_features(features)
+
+    def detect(self, image, annotate=False, progress=None, cancel=None, scale=1):
+        """Detecta figuras en una imagen BGR (o en escala de grises).
+
+        Args:
+            image: arreglo NumPy ``uint8`` de 2 o 3 canales.
+            annotate: si es ``True`` se genera además la imagen anotada.
+            progress: callback opcional ``progress(etapa, fraccion)`` llamado al
+                comenzar cada etapa de ``STAGES``.
+            cancel: objeto opcional con ``is_set()`` (p. ej. ``threading.Event``);
+                si se activa, la detección se interrumpe con ``DetectionCancelled``.
+            scale: factor con el que ``image`` ya viene reducida (ver
+                ``read_for_detection``); las medidas se devuelven a escala original.
+
+        Returns:
+            DetectionResult con las figuras encontradas.
+        """
+        if image is None:
+            raise ValueError("La imagen es None")
+        if annotate and scale != 1:
+            raise ValueError("No se puede anotar una imagen decodificada a escala reducida")
+
+        p = self.params
+        total_stages = len(STAGES) if annotate else len(STAGES) - 1
+        stats = DetectionStats()
+        current = [None, time.perf_counter()]  # etapa en curso y su inicio
+
+        def close_stage():
+            now = time.perf_counter()
+            if current[0] is not None:
+                stats.timings[current[0]] = stats.timings.get(current[0], 0.0) + (now - current[1]) * 1000
+            current[1] = now
+
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(image, p)
+            if scale != 1:
+                key += f"-x{scale}"
+            if self.classifier is not None:
+                key += f"-t{self.classifier.digest}"
+            cached = self.cache.get(key, annotated=annotate)
+            if cached is not None:
+                current[0] = "cache"
+                close_stage()
+                stats.cache_hit = True
+                stats.shapes_per_class = dict(Counter(s['nombre'] for s in cached.shapes))
+                cached.stats = stats
+                if progress is not None:
+                    progress("listo", 1.0)
+                return cached
+
+        def stage(name):
+            close_stage()
+            current[0] = name
+            if cancel is not None and cancel.is_set():
+                raise DetectionCancelled(name)
+            if progress is not None:
+                progress(name, STAGES.index(name) / total_stages)
+
+        # Preprocesamiento
+        stage("gris")
+        if image.ndim == 3:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            stats.bytes_allocated += gray.nbytes
+        else:
+            gray = image
+
+        level = choose_pyramid_level(gray.shape, p.min_area / scale ** 2) if p.pyramid else 0
+        work = gray
+        for _ in range(level):
+            work = cv2.pyrDown(work)
+            stats.bytes_allocated += work.nbytes
+        factor = scale * 2 ** level
+
+        contours = self._find_contours(work, stage)
+        # Desenfoque y bordes tienen el tamaño de ``work``
+        stats.bytes_allocated += 2 * work.nbytes + sum(c.nbytes for c in contours)
+        stats.contours_found = len(contours)
+
+        stage("clasificacion")
+        features = extract_features(contours, p.epsilon_factor, p.min_area / factor ** 2,
+                                    cancel=cancel)
+        if factor != 1:
+            features = features.scaled(factor)
+            if p.refine and scale == 1:
+                features = self._refine(gray, features, factor, cancel)
+        stats.contours_filtered = stats.contours_found - len(features)
+
+        names = self.classify(features)
+        image_size = (image.shape[0] * scale, image.shape[1] * scale)
+        result = DetectionResult.from_features(features, image_size, names)
+        result.pyramid_level = int(factor).bit_length() - 1
+        stats.shapes_per_class = dict(Counter(names))
+
+        if annotate:
+            stage("anotacion")
+            result.annotated = draw_annotations(image, result)
+            stats.bytes_allocated += result.annotated.nbytes
+
+        close_stage()
+        result.stats = stats
+
+        if key is not None:
+            self.cache.put(key, result)
+
+        if progress is not None:
+            progress("listo", 1.0)
+
+        return result
+
+    def _find_contours(self, gray, stage=None):
+        """Desenfoque, Canny y contornos externos sobre una imagen en grises.
+
+        Las máscaras binarias (con ``mask_shortcut``) van directamente a
+        ``findContours`` (ver ``mask_contours``).
+        """
+        p = self.params
+        if p.mask_shortcut and is_binary_mask(gray):
+            if stage is not None:
+                stage("contornos")
+            return mask_contours(gray)
+
+        if stage is not None:
+            stage("desenfoque")
+        blurred = cv2.GaussianBlur(gray, (p.blur_kernel, p.blur_kernel), 0)
+        if stage is not None:
+            stage("bordes")
+        edges = cv2.Canny(blurred, p.canny_low, p.canny_high)
+
+        # Encontrar contornos
+        if stage is not None:
+            stage("contornos")
+        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return contours
+
+    def _refine(self, gray, features, factor, cancel=None):
+        """Vuelve a medir cada figura a resolución completa dentro de su rectángulo.
+
+        Si en el recorte no aparece una figura válida se conserva la medida del
+        nivel reducido.
+        """
+        p = self.params
+        h, w = gray.shape[:2]
+        pad = 2 * factor + p.blur_kernel
+        rows = []
+        for i in range(len(features)):
+            if cancel is not None and cancel.is_set():
+                raise DetectionCancelled("clasificacion")
+            x, y, bw, bh = features.bbox[i].tolist()
+            x0, y0 = max(x - pad, 0), max(y - pad, 0)
+            x1, y1 = min(x + bw + pad, w), min(y + bh + pad, h)
+            roi = gray[y0:y1, x0:x1]
+            local = extract_features(self._find_contours(roi), p.epsilon_factor, p.min_area)
+            if len(local):
+                # La figura buscada es la mayor dentro del recorte
+                best = int(np.argmax(local.area))
+                rows.append(local.take([best]).shifted(x0, y0))
+            else:
+                rows.append(features.take([i]))
+        return ContourFeatures.concat(rows)
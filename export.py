@@ -0,0 +1,213 @@
+"""Exportadores de resultados en streaming: JSONL, CSV y NPZ.
+
+Todos reciben registros de imagen (ver ``result_to_record``) de uno en uno y los
+escriben a medida que llegan, así que el uso de memoria no depende del número
+de imágenes:
+
+* ``JsonlExporter``: una línea JSON por imagen.
+* ``CsvExporter``: una fila por figura.
+* ``NpzExporter``: bloques ``<base>.00000.npz``, ``<base>.00001.npz``... con
+  columnas NumPy y los puntos de los contornos empaquetados; se vuelca un
+  bloque cada ``chunk_shapes`` figuras.
+"""
+import csv
+import glob
+import json
+import os
+
+import numpy as np
+
+
+EXPORT_FORMATS = ("jsonl", "csv", "npz")
+
+CSV_FIELDS = ("path", "numero", "nombre", "area", "vertices", "centro_x", "centro_y")
+
+
+def shape_to_dict(shape):
+    """Copia serializable en JSON de un dict de ``shapes_list``."""
+    return {
+        "numero": int(shape["numero"]),
+        "nombre": shape["nombre"],
+        "area": float(shape["area"]),
+        "vertices": int(shape["vertices"]),
+        "centro": [int(shape["centro"][0]), int(shape["centro"][1])],
+    }
+
+
+def result_to_record(path, result, include_contours=False):
+    """Registro de una imagen procesada, listo para cualquier exportador."""
+    record = {
+        "path": path,
+        "ok": True,
+        "image_size": [int(v) for v in result.image_size],
+        "count": len(result.shapes),
+        "shapes": [shape_to_dict(s) for s in result.shapes],
+    }
+    if include_contours:
+        record["contours"] = [np.asarray(c, dtype=np.int32).reshape(-1, 2) for c in result.contours]
+    return record
+
+
+class _FileExporter:
+    """Base para exportadores de texto sobre un archivo o un flujo abierto."""
+
+    def __init__(self, target, buffer_size=64 * 1024):
+        if isinstance(target, (str, os.PathLike)):
+            self._file = open(target, "w", encoding="utf-8", newline="", buffering=buffer_size)
+            self._owns_file = True
+        else:
+            self._file = target
+            self._owns_file = False
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._owns_file:
+            self._file.close()
+        else:
+            self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonlExporter(_FileExporter):
+    """Una línea JSON por imagen; con ``include_contours`` añade los polígonos."""
+
+    def __init__(self, target, include_contours=False, buffer_size=64 * 1024):
+        super().__init__(target, buffer_size)
+        self.include_contours = include_contours
+
+    def write(self, record):
+        record = dict(record)
+        contours = record.pop("contours", None)
+        if self.include_contours and contours is not None:
+            record["contours"] = [np.asarray(c).reshape(-1, 2).tolist() for c in contours]
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class CsvExporter(_FileExporter):
+    """Una fila por figura; las imágenes fallidas no generan filas."""
+
+    def __init__(self, target, buffer_size=64 * 1024):
+        super().__init__(target, buffer_size)
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(CSV_FIELDS)
+
+    def write(self, record):
+        for s in record.get("shapes", ()):
+            self._writer.writerow((
+                record["path"], s["numero"], s["nombre"], f"{s['area']:.1f}", s["vertices"],
+                s["centro"][0], s["centro"][1],
+            ))
+
+
+class NpzExporter:
+    """Escribe bloques NPZ con columnas por figura y contornos empaquetados.
+
+    Cada bloque contiene:
+
+    * ``paths``: rutas de las imágenes del bloque; ``image``: índice de la ruta
+      de cada figura.
+    * ``numero``, ``area``, ``vertices``, ``centro`` (N, 2) y ``nombre_code``
+      con su tabla ``nombres``.
+    * ``points`` (M, 2) ``int32`` y ``offsets`` (N + 1): los puntos del contorno
+      ``i`` son ``points[offsets[i]:offsets[i + 1]]``.
+
+    Los bloques se llaman ``<base>.00000.npz``, ``<base>.00001.npz``...; las
+    rutas ya escritas quedan en ``written``.
+    """
+
+    def __init__(self, base_path, chunk_shapes=100_000):
+        self.base_path = base_path[:-4] if base_path.endswith(".npz") else base_path
+        self.chunk_shapes = chunk_shapes
+        self._chunk = 0
+        self.written = []
+        self._reset()
+
+    def _reset(self):
+        self._paths = []
+        self._image = []
+        self._numero = []
+        self._nombre = []
+        self._area = []
+        self._vertices = []
+        self._centro = []
+        self._contours = []
+
+    def write(self, record):
+        if not record.get("ok"):
+            return
+        contours = record.get("contours")
+        if contours is None:
+            raise ValueError("NpzExporter necesita registros con 'contours'")
+        image_index = len(self._paths)
+        self._paths.append(record["path"])
+        for s, contour in zip(record["shapes"], contours):
+            self._image.append(image_index)
+            self._numero.append(s["numero"])
+            self._nombre.append(s["nombre"])
+            self._area.append(s["area"])
+            self._vertices.append(s["vertices"])
+            self._centro.append(s["centro"])
+            self._contours.append(np.asarray(contour, dtype=np.int32).reshape(-1, 2))
+        if len(self._numero) >= self.chunk_shapes or len(self._paths) >= self.chunk_shapes:
+            self.flush()
+
+    def flush(self):
+        if not self._paths:
+            return
+        nombres, codes = np.unique(np.array(self._nombre, dtype=str), return_inverse=True)
+        offsets = np.cumsum([0] + [len(c) for c in self._contours]).astype(np.int64)
+        points = np.concatenate(self._contours) if self._contours else np.empty((0, 2), np.int32)
+        path = f"{self.base_path}.{self._chunk:05d}.npz"
+        np.savez(
+            path,
+            paths=np.array(self._paths, dtype=str),
+            image=np.array(self._image, dtype=np.int32),
+            numero=np.array(self._numero, dtype=np.int32),
+            nombres=nombres,
+            nombre_code=codes.astype(np.int16),
+            area=np.array(self._area, dtype=np.float64),
+            vertices=np.array(self._vertices, dtype=np.int32),
+            centro=np.array(self._centro, dtype=np.int32).reshape(-1, 2),
+            offsets=offsets,
+            points=points,
+        )
+        self.written.append(path)
+        self._chunk += 1
+        self._reset()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_npz_chunks(base_path):
+    """Recorre los bloques escritos por ``NpzExporter`` en orden."""
+    base_path = base_path[:-4] if base_path.endswith(".npz") else base_path
+    for path in sorted(glob.glob(glob.escape(base_path) + ".[0-9][0-9][0-9][0-9][0-9].npz")):
+        with np.load(path, allow_pickle=False) as data:
+            yield {key: data[key] for key in data.files}
+
+
+def open_exporter(fmt, target, include_contours=False):
+    """Crea el exportador de ``fmt`` (uno de ``EXPORT_FORMATS``) sobre ``target``."""
+    if fmt == "jsonl":
+        return JsonlExporter(target, include_contours=include_contours)
+    if fmt == "csv":
+        return CsvExporter(target)
+    if fmt == "npz":
+        if not isinstance(target, (str, os.PathLike)):
+            raise ValueError("El formato npz necesita una ruta de salida")
+        return NpzExporter(os.fspath(target))
+    raise ValueError(f"Formato de exportación desconocido: {fmt}")
@@ -1,10 +1,50 @@
 import cv2
 import numpy as np
-import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
-from tkinter import font as tkfont
-from PIL import Image, ImageTk
 import os
+import queue
+import threading
+import time
+
+from detector import (DetectionCancelled, DetectionParams, draw_annotations, identify_shape,
+                      get_color_for_shape)
+from export import open_exporter, result_to_record
+from incremental import IncrementalDetector
+from tiled import TiledDetector
+
+# Tk y Pillow se importan al construir la ventana (ver ``_load_gui``): importar
+# este módulo desde scripts o procesos sin pantalla no debe pagar su coste.
+tk = filedialog = messagebox = ttk = tkfont = Image = ImageTk = None
+
+
+def _load_gui():
+    global tk, filedialog, messagebox, ttk, tkfont, Image, ImageTk
+    if tk is not None:
+        return
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, ttk
+    from tkinter import font as tkfont
+    from PIL import Image, ImageTk
+
+
+# Textos de estado para cada etapa notificada por ShapeDetector.detect
+STAGE_LABELS = {
+    "gris": "Convirtiendo a escala de grises...",
+    "desenfoque": "Aplicando desenfoque...",
+    "bordes": "Detectando bordes...",
+    "contornos": "Buscando contornos...",
+    "clasificacion": "Clasificando figuras...",
+    "anotacion": "Dibujando resultados...",
+    "listo": "Finalizando...",
+}
+
+# Controles de parámetros: (campo de DetectionParams, etiqueta, mínimo, máximo, paso)
+PARAM_CONTROLS = (
+    ("blur_kernel", "Desenfoque", 1, 31, 2),
+    ("canny_low", "Canny bajo", 0, 255, 1),
+    ("canny_high", "Canny alto", 0, 255, 1),
+    ("epsilon_factor", "Épsilon", 0.005, 0.1, 0.005),
+    ("min_area", "Área mínima", 0, 20000, 50),
+)
 
 
 class Tooltip:
@@ -46,8 +86,403 @@ class Tooltip:
             self.tipwindow = None
 
 
+class ImagePreview:
+    """Vista previa de una imagen en un canvas con caché y redibujado diferido.
+
+    La conversión BGR→RGB se hace una sola vez por imagen y el mapa de bits
+    redimensionado se reutiliza mientras no cambie el tamaño del canvas. Los
+    cambios de tamaño (``<Configure>``) se agrupan y sólo redibujan al terminar.
+    """
+    def __init__(self, canvas, delay=80):
+        self.canvas = canvas
+        self.delay = delay
+        self._source = None
+        self._rgb = None
+        self._photo = None
+        self._size = None
+        self._drawn = False
+        self._after_id = None
+        # Transformación imagen -> canvas del último dibujo
+        self.scale = 1.0
+        self.offset = (0, 0)
+        # Callbacks llamados tras dibujar la imagen base (p. ej. ShapeOverlay)
+        self.on_render = []
+        canvas.bind("<Configure>", self._on_configure)
+
+    def set_image(self, cv_image):
+        if cv_image is None:
+            self.clear()
+            return
+        if cv_image is not self._source:
+            self._source = cv_image
+            if cv_image.ndim == 2:
+                self._rgb = cv2.cvtColor(cv_image, cv2.COLOR_GRAY2RGB)
+            else:
+                self._rgb = cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB)
+            self._size = None
+        self._drawn = False
+        self.render()
+
+    def clear(self):
+        self._source = self._rgb = self._photo = self._size = None
+        self._drawn = False
+        self.canvas.delete("all")
+
+    def _on_configure(self, _event=None):
+        if self._after_id:
+            self.canvas.after_cancel(self._after_id)
+        self._after_id = self.canvas.after(self.delay, self.render)
+
+    def render(self):
+        """Dibuja la imagen ajustada al canvas, reutilizando el mapa de bits si se puede."""
+        self._after_id = None
+        if self._rgb is None:
+            return
+        canvas_width = self.canvas.winfo_width()
+        canvas_height = self.canvas.winfo_height()
+        # Canvas aún sin mapear: el primer <Configure> volverá a llamar a render
+        if canvas_width <= 1 or canvas_height <= 1:
+            return
+
+        size = (canvas_width, canvas_height)
+        if size == self._size and self._drawn:
+            return
+        if size != self._size:
+            # Redimensionar imagen manteniendo aspecto
+            h, w = self._rgb.shape[:2]
+            scale = min(canvas_width / w, canvas_height / h) * 0.95
+            new_w, new_h = max(int(w * scale), 1), max(int(h * scale), 1)
+            interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+            resized = cv2.resize(self._rgb, (new_w, new_h), interpolation=interpolation)
+            self._photo = ImageTk.PhotoImage(Image.fromarray(resized))
+            self._size = size
+            self.scale = scale
+            self.offset = (canvas_width // 2 - new_w // 2, canvas_height // 2 - new_h // 2)
+
+        self.canvas.delete("base")
+        self.canvas.create_image(*self.offset, image=self._photo, anchor=tk.NW, tags="base")
+        self.canvas.tag_lower("base")
+        self._drawn = True
+        for callback in self.on_render:
+            callback()
+
+
+def _bgr_to_hex(color):
+    b, g, r = color
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+class ShapeOverlay:
+    """Dibuja las figuras detectadas como elementos vectoriales del canvas.
+
+    Los polígonos y textos se colocan sobre la imagen base de un ``ImagePreview``
+    usando su escala y desplazamiento, así que mostrar u ocultar etiquetas,
+    cambiar de tema o resaltar una figura no requiere rasterizar nada.
+    """
+    def __init__(self, preview):
+        self.preview = preview
+        self.canvas = preview.canvas
+        self.result = None
+        self.show_labels = True
+        self.label_bg = None
+        self.selected = None
+        self.hovered = None
+        preview.on_render.append(self.redraw)
+
+    def set_result(self, result):
+        self.result = result
+        self.selected = self.hovered = None
+        self.redraw()
+
+    def clear(self):
+        self.result = None
+        self.selected = self.hovered = None
+        self.canvas.delete("overlay")
+
+    def set_show_labels(self, show):
+        self.show_labels = show
+        self.canvas.itemconfigure("label", state=tk.NORMAL if show else tk.HIDDEN)
+
+    def _width(self, index):
+        if index == self.selected:
+            return 5
+        return 4 if index == self.hovered else 2
+
+    def select(self, index):
+        """Resalta la figura ``index`` (posición en ``result.shapes``) o ninguna con ``None``."""
+        previous, self.selected = self.selected, index
+        if previous is not None:
+            self.canvas.itemconfigure(f"shape{previous}", width=self._width(previous))
+        if index is not None:
+            self.canvas.itemconfigure(f"shape{index}", width=5)
+            self.canvas.tag_raise(f"shape{index}")
+
+    def hover(self, index):
+        """Marca la figura bajo el cursor (más fina que la selección)."""
+        if index == self.hovered:
+            return
+        previous, self.hovered = self.hovered, index
+        for i in (previous, index):
+            if i is not None:
+                self.canvas.itemconfigure(f"shape{i}", width=self._width(i))
+
+    def redraw(self):
+        self.canvas.delete("overlay")
+        if self.result is None or not self.preview._drawn:
+            return
+        scale = self.preview.scale
+        ox, oy = self.preview.offset
+        label_state = tk.NORMAL if self.show_labels else tk.HIDDEN
+
+        for i, (shape, approx) in enumerate(zip(self.result.shapes, self.result.contours)):
+            color = _bgr_to_hex(get_color_for_shape(shape['nombre']))
+            pts = (approx.reshape(-1, 2) * scale + (ox, oy)).ravel().tolist()
+            self.canvas.create_polygon(
+                *pts, outline=color, fill="", width=self._width(i),
+                tags=("overlay", f"shape{i}")
+            )
+            cX = shape['centro'][0] * scale + ox
+            cY = shape['centro'][1] * scale + oy
+            for text, dy, size in ((f"#{shape['numero']}", -10, 10), (shape['nombre'], 8, 9)):
+                item = self.canvas.create_text(
+                    cX, cY + dy, text=text, fill=color, font=("Segoe UI", size, "bold"),
+                    state=label_state, tags=("overlay", "label")
+                )
+                if self.label_bg:
+                    bbox = self.canvas.create_rectangle(
+                        *self.canvas.bbox(item), fill=self.label_bg, outline="",
+                        state=label_state, tags=("overlay", "label")
+                    )
+                    self.canvas.tag_lower(bbox, item)
+
+
+class VirtualTable:
+    """Tabla de resultados virtualizada sobre un ``ttk.Treeview``.
+
+    Sólo existen tantas filas como caben en pantalla; al desplazarse se
+    reescriben sus valores a partir de los datos. Ordenar reordena un arreglo de
+    índices y limpiar sólo vacía las filas visibles, sin importar cuántas
+    figuras haya.
+    """
+    ROW_HEIGHT = 26
+
+    def __init__(self, parent, columns, on_select=None):
+        """``columns`` es una lista de ``(id, título, ancho, anclaje)``."""
+        self.on_select = on_select
+        self.shapes = []
+        self._order = np.empty(0, dtype=np.int64)
+        self._sort_keys = {}
+        self._sort_column = None
+        self._sort_reverse = False
+        self._top = 0
+        self._rows = []
+        self._selected = None
+        self._updating = False
+
+        ids = [c[0] for c in columns]
+        self.tree = ttk.Treeview(parent, columns=ids, show="headings", height=6, selectmode="browse")
+        for col, title, width, anchor in columns:
+            self.tree.heading(col, text=title, command=lambda c=col: self.sort_by(c))
+            self.tree.column(col, width=width, anchor=anchor)
+
+        self.vsb = ttk.Scrollbar(parent, orient="vertical", command=self._on_scrollbar)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.vsb.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.tree.bind("<Configure>", self._on_configure)
+        self.tree.bind("<<TreeviewSelect>>", self._on_tree_select)
+        self.tree.bind("<MouseWheel>", self._on_wheel)
+        self.tree.bind("<Button-4>", lambda e: self._scroll_rows(-3))
+        self.tree.bind("<Button-5>", lambda e: self._scroll_rows(3))
+        self.tree.bind("<Up>", lambda e: self._move_selection(-1))
+        self.tree.bind("<Down>", lambda e: self._move_selection(1))
+        self._resize_pool(6)
+
+    # -- datos ----------------------------------------------------------
+
+    def set_shapes(self, shapes):
+        self.shapes = shapes
+        n = len(shapes)
+        self._order = np.arange(n)
+        self._sort_keys = {
+            "numero": np.array([s['numero'] for s in shapes]),
+            "tipo": np.array([s['nombre'] for s in shapes], dtype=object),
+            "vertices": np.array([s['vertices'] for s in shapes]),
+            "area": np.array([s['area'] for s in shapes], dtype=np.float64),
+            "centro": np.array([(s['centro'][1], s['centro'][0]) for s in shapes]).reshape(n, 2),
+        }
+        self._sort_column = None
+        self._sort_reverse = False
+        self._top = 0
+        self._selected = None
+        self._refresh()
+
+    def clear(self):
+        self.shapes = []
+        self._order = np.empty(0, dtype=np.int64)
+        self._sort_keys = {}
+        self._top = 0
+        self._selected = None
+        self._refresh()
+
+    def sort_by(self, column):
+        """Ordena por ``column``; un segundo clic invierte el orden."""
+        if not self.shapes:
+            return
+        if column == self._sort_column:
+            self._sort_reverse = not self._sort_reverse
+        else:
+            self._sort_column, self._sort_reverse = column, False
+        key = self._sort_keys[column]
+        if key.ndim == 2:
+            order = np.lexsort((key[:, 1], key[:, 0]))
+        else:
+            order = np.argsort(key, kind="stable")
+        self._order = order[::-1] if self._sort_reverse else order
+        self._top = 0
+        self._refresh()
+
+    # -- desplazamiento -------------------------------------------------
+
+    def _visible_rows(self):
+        return len(self._rows)
+
+    def _max_top(self):
+        return max(len(self._order) - self._visible_rows(), 0)
+
+    def _set_top(self, top):
+        top = min(max(int(top), 0), self._max_top())
+        if top != self._top:
+            self._top = top
+            self._refresh()
+
+    def _scroll_rows(self, delta):
+        self._set_top(self._top + delta)
+        return "break"
+
+    def _on_wheel(self, event):
+        return self._scroll_rows(-3 if event.delta > 0 else 3)
+
+    def _on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self._set_top(float(value) * len(self._order))
+        elif action == "scroll":
+            step = self._visible_rows() if unit == "pages" else 1
+            self._set_top(self._top + int(value) * step)
+
+    def _on_configure(self, event):
+        heading = self.ROW_HEIGHT
+        rows = max((event.height - heading) // self.ROW_HEIGHT, 1)
+        if rows != len(self._rows):
+            self._resize_pool(rows)
+            self._set_top(self._top)
+            self._refresh()
+
+    def _resize_pool(self, rows):
+        self._updating = True
+        while len(self._rows) < rows:
+            iid = f"row{len(self._rows)}"
+            self.tree.insert("", tk.END, iid=iid, values=())
+            self._rows.append(iid)
+        while len(self._rows) > rows:
+            self.tree.delete(self._rows.pop())
+        self._updating = False
+
+    # -- selección ------------------------------------------------------
+
+    def _on_tree_select(self, _event=None):
+        selection = self.tree.selection()
+        # Las filas se deseleccionan al desplazar la figura elegida fuera de la
+        # vista; eso no cambia la selección real
+        if self._updating or not selection:
+            return
+        pos = self._top + self._rows.index(selection[0])
+        if pos >= len(self._order):
+            return
+        index = int(self._order[pos])
+        if index != self._selected:
+            self._selected = index
+            if self.on_select is not None:
+                self.on_select(index)
+
+    def select(self, index):
+        """Selecciona la figura ``index`` (o ninguna) y la muestra, sin llamar a ``on_select``.
+
+        Una figura que no está en la tabla (vaciada mientras se detecta) se ignora.
+
+        Returns:
+            ``True`` si la selección cambió a ``index``, ``False`` si se ignoró.
+        """
+        if index is not None:
+            pos = np.flatnonzero(self._order == index)
+            if not len(pos):
+                return False
+            self._scroll_into_view(int(pos[0]))
+        self._selected = index
+        self._refresh()
+        return True
+
+    def _scroll_into_view(self, pos):
+        if pos < self._top:
+            self._set_top(pos)
+        elif pos >= self._top + self._visible_rows():
+            self._set_top(pos - self._visible_rows() + 1)
+
+    def _move_selection(self, delta):
+        if not len(self._order):
+            return "break"
+        if self._selected is None:
+            pos = self._top
+        else:
+            pos = int(np.flatnonzero(self._order == self._selected)[0]) + delta
+        pos = min(max(pos, 0), len(self._order) - 1)
+        self._scroll_into_view(pos)
+        self._selected = int(self._order[pos])
+        self._refresh()
+        if self.on_select is not None:
+            self.on_select(self._selected)
+        return "break"
+
+    # -- dibujo ---------------------------------------------------------
+
+    def _refresh(self):
+        """Reescribe sólo las filas visibles."""
+        self._updating = True
+        selected_row = None
+        for i, iid in enumerate(self._rows):
+            pos = self._top + i
+            if pos < len(self._order):
+                index = int(self._order[pos])
+                shape = self.shapes[index]
+                self.tree.item(iid, values=(
+                    shape['numero'],
+                    shape['nombre'],
+                    shape['vertices'],
+                    f"{shape['area']:.0f}",
+                    f"({shape['centro'][0]}, {shape['centro'][1]})"
+                ))
+                if index == self._selected:
+                    selected_row = iid
+            else:
+                self.tree.item(iid, values=())
+        if selected_row:
+            self.tree.selection_set(selected_row)
+        else:
+            self.tree.selection_remove(self.tree.selection())
+        self._updating = False
+
+        n = len(self._order)
+        if n:
+            first = self._top / n
+            last = min(self._top + self._visible_rows(), n) / n
+            self.vsb.set(first, last)
+        else:
+            self.vsb.set(0.0, 1.0)
+
+
 class ShapeDetectorApp:
     def __init__(self, root):
+        _load_gui()
         self.root = root
         self.root.title("Detector de Figuras Geométricas")
         self.root.geometry("1000x720")
@@ -57,7 +492,20 @@ class ShapeDetectorApp:
         self.image_path = None
         self.original_image = None
         self.processed_image = None
+        self.detection_result = None
+        self.last_display_ms = 0.0
         self.shapes_list = []
+        self.show_labels = tk.BooleanVar(value=True)
+        # Pipeline incremental: al mover un control sólo se repiten las etapas
+        # afectadas, y repetir la detección sin cambios es inmediato
+        self.detector = IncrementalDetector()
+        self._param_vars = {}
+        self._param_after_id = None
+        # Estado del trabajo de detección en segundo plano
+        self._job_id = 0
+        self._cancel_event = None
+        self._worker_queue = queue.Queue()
+        self._poll_after_id = None
         self.status_var = tk.StringVar(value="Listo")
         self.summary_var = tk.StringVar(value="Sin resultados")
 
@@ -97,6 +545,18 @@ class ShapeDetectorApp:
         self.detect_btn.pack(side=tk.LEFT, padx=(10, 0))
         Tooltip(self.detect_btn, "Analizar la imagen y detectar figuras")
 
+        self.cancel_btn = ttk.Button(
+            control_frame,
+            text="Cancelar",
+            command=self.cancel_detection,
+            style="Danger.TButton",
+            cursor="hand2",
+            state=tk.DISABLED,
+            width=14
+        )
+        self.cancel_btn.pack(side=tk.LEFT, padx=(10, 0))
+        Tooltip(self.cancel_btn, "Detener la detección en curso (Esc)")
+
         self.save_btn = ttk.Button(
             control_frame,
             text="Guardar resultado",
@@ -120,6 +580,24 @@ class ShapeDetectorApp:
         self.clear_btn.pack(side=tk.LEFT, padx=(10, 0))
         Tooltip(self.clear_btn, "Limpiar imágenes y resultados")
 
+        # Parámetros del pipeline
+        params_frame = ttk.Frame(self.root, padding=(12, 0, 12, 8))
+        params_frame.pack(side=tk.TOP, fill=tk.X)
+        defaults = DetectionParams()
+        for column, (name, label, lo, hi, step) in enumerate(PARAM_CONTROLS):
+            var = tk.DoubleVar(value=getattr(defaults, name))
+            text = tk.StringVar(value=self._format_param(name, var.get()))
+            self._param_vars[name] = (var, text, lo, step)
+            cell = ttk.Frame(params_frame)
+            cell.grid(row=0, column=column, sticky="ew", padx=(0 if column == 0 else 12, 0))
+            params_frame.columnconfigure(column, weight=1)
+            ttk.Label(cell, text=label, style="Subtle.TLabel").pack(side=tk.LEFT)
+            ttk.Label(cell, textvariable=text, width=7, anchor=tk.E).pack(side=tk.RIGHT)
+            ttk.Scale(
+                cell, from_=lo, to=hi, variable=var,
+                command=lambda _value, n=name: self._on_param_change(n),
+            ).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(6, 0))
+
         ttk.Separator(self.root).pack(fill=tk.X)
 
         # Zona de imágenes con PanedWindow redimensionable
@@ -136,6 +614,23 @@ class ShapeDetectorApp:
         self.processed_canvas = tk.Canvas(self.processed_frame, bg="#e9eef5", highlightthickness=0)
         self.processed_canvas.pack(fill=tk.BOTH, expand=True)
 
+        self._previews = {
+            self.original_canvas: ImagePreview(self.original_canvas),
+            self.processed_canvas: ImagePreview(self.processed_canvas),
+        }
+        self.overlay = ShapeOverlay(self._previews[self.processed_canvas])
+
+        # Arrastrar sobre la imagen original vuelve a detectar sólo esa región
+        self._roi_start = None
+        self.original_canvas.bind("<ButtonPress-1>", self._on_roi_press)
+        self.original_canvas.bind("<B1-Motion>", self._on_roi_drag)
+        self.original_canvas.bind("<ButtonRelease-1>", self._on_roi_release)
+
+        # Pasar el cursor o hacer clic sobre una figura la resalta y la elige en la tabla
+        self.processed_canvas.bind("<Motion>", self._on_canvas_motion)
+        self.processed_canvas.bind("<Leave>", lambda e: self.overlay.hover(None))
+        self.processed_canvas.bind("<Button-1>", self._on_canvas_click)
+
         self.paned.add(self.original_frame, weight=1)
         self.paned.add(self.processed_frame, weight=1)
 
@@ -151,33 +646,55 @@ class ShapeDetectorApp:
         table_frame = ttk.Frame(results_container)
         table_frame.pack(fill=tk.BOTH, expand=True, pady=(6, 0))
 
-        columns = ("numero", "tipo", "vertices", "area", "centro")
-        self.tree = ttk.Treeview(table_frame, columns=columns, show="headings", height=6)
-        self.tree.heading("numero", text="#")
-        self.tree.heading("tipo", text="Tipo")
-        self.tree.heading("vertices", text="Vértices")
-        self.tree.heading("area", text="Área (px²)")
-        self.tree.heading("centro", text="Centro (x, y)")
-        self.tree.column("numero", width=60, anchor=tk.CENTER)
-        self.tree.column("tipo", width=160, anchor=tk.W)
-        self.tree.column("vertices", width=90, anchor=tk.CENTER)
-        self.tree.column("area", width=130, anchor=tk.E)
-        self.tree.column("centro", width=150, anchor=tk.CENTER)
-
-        vsb = ttk.Scrollbar(table_frame, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscrollcommand=vsb.set)
-        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        vsb.pack(side=tk.RIGHT, fill=tk.Y)
+        self.table = VirtualTable(table_frame, [
+            ("numero", "#", 60, tk.CENTER),
+            ("tipo", "Tipo", 160, tk.W),
+            ("vertices", "Vértices", 90, tk.CENTER),
+            ("area", "Área (px²)", 130, tk.E),
+            ("centro", "Centro (x, y)", 150, tk.CENTER),
+        ], on_select=self._on_table_select)
+        self.tree = self.table.tree
 
         # Barra de estado
         status_bar = ttk.Frame(self.root, padding=(12, 6))
         status_bar.pack(side=tk.BOTTOM, fill=tk.X)
         self.status_label = ttk.Label(status_bar, textvariable=self.status_var, style="Subtle.TLabel")
         self.status_label.pack(side=tk.LEFT)
+        self.progress = ttk.Progressbar(status_bar, mode="determinate", maximum=1.0, length=200)
+        self.progress.pack(side=tk.RIGHT)
 
         # Estado inicial
         self._set_status("Listo para cargar una imagen.")
 
+    @staticmethod
+    def _format_param(name, value):
+        return f"{value:.3f}" if name == "epsilon_factor" else f"{value:.0f}"
+
+    def _current_params(self):
+        values = {name: var.get() for name, (var, _text, _lo, _step) in self._param_vars.items()}
+        return DetectionParams(
+            blur_kernel=int(values["blur_kernel"]),
+            canny_low=int(values["canny_low"]),
+            canny_high=int(values["canny_high"]),
+            epsilon_factor=values["epsilon_factor"],
+            min_area=values["min_area"],
+        )
+
+    def _on_param_change(self, name):
+        """Ajusta el control a su paso y relanza la detección tras una breve pausa."""
+        var, text, lo, step = self._param_vars[name]
+        value = lo + round((var.get() - lo) / step) * step
+        var.set(round(value, 6))
+        text.set(self._format_param(name, value))
+        if self._param_after_id is not None:
+            self.root.after_cancel(self._param_after_id)
+        self._param_after_id = self.root.after(120, self._apply_params)
+
+    def _apply_params(self):
+        self._param_after_id = None
+        if self.original_image is not None:
+            self.detect_shapes()
+
     def _setup_fonts(self):
         """Configura fuentes predeterminadas para una apariencia nativa más cuidada."""
         try:
@@ -250,12 +767,15 @@ class ShapeDetectorApp:
         filemenu = tk.Menu(menubar, tearoff=0)
         filemenu.add_command(label="Cargar imagen	Ctrl+O", command=self.load_image)
         filemenu.add_command(label="Detectar figuras	Ctrl+D", command=self.detect_shapes, state=tk.DISABLED)
+        filemenu.add_command(label="Exportar resultados...", command=self.export_results)
         filemenu.add_separator()
         filemenu.add_command(label="Salir	Ctrl+Q", command=self.root.quit)
         menubar.add_cascade(label="Archivo", menu=filemenu)
 
         viewmenu = tk.Menu(menubar, tearoff=0)
         viewmenu.add_command(label="Alternar modo claro/oscuro", command=self.toggle_theme)
+        viewmenu.add_checkbutton(label="Mostrar etiquetas", variable=self.show_labels,
+                                 command=self._on_toggle_labels)
         menubar.add_cascade(label="Ver", menu=viewmenu)
 
         helpmenu = tk.Menu(menubar, tearoff=0)
@@ -271,6 +791,7 @@ class ShapeDetectorApp:
         self.root.bind_all("<Control-o>", lambda e: self.load_image())
         self.root.bind_all("<Control-d>", lambda e: self.detect_shapes())
         self.root.bind_all("<Control-l>", lambda e: self.clear_all())
+        self.root.bind_all("<Escape>", lambda e: self.cancel_detection())
         self.root.bind_all("<Control-q>", lambda e: self.root.quit())
 
     def toggle_theme(self):
@@ -280,6 +801,8 @@ class ShapeDetectorApp:
         bg_canvas = "#1f2937" if self.dark_mode else "#e9eef5"
         for c in (self.original_canvas, self.processed_canvas):
             c.configure(bg=bg_canvas)
+        self.overlay.label_bg = "#111827" if self.dark_mode else None
+        self.overlay.redraw()
         self._set_status("Modo oscuro activado" if self.dark_mode else "Modo claro activado")
 
     def _set_status(self, text):
@@ -296,6 +819,8 @@ class ShapeDetectorApp:
         )
         
         if file_path:
+            # Una detección en curso es de la imagen anterior
+            self._invalidate_job()
             self.image_path = file_path
             self.original_image = cv2.imread(file_path)
             
@@ -303,6 +828,7 @@ class ShapeDetectorApp:
                 messagebox.showerror("Error", "No se pudo cargar la imagen")
                 return
             
+            self.original_canvas.delete("roi")
             self.display_image(self.original_image, self.original_canvas)
             self.detect_btn.config(state=tk.NORMAL)
             try:
@@ -311,196 +837,250 @@ class ShapeDetectorApp:
                 pass
             self.save_btn.config(state=tk.DISABLED)
             self._clear_results_table()
+            # Descartar las figuras de la imagen anterior
+            self.detection_result = None
+            self.processed_image = None
+            self.overlay.clear()
+            self._previews[self.processed_canvas].clear()
             self.summary_var.set("Imagen cargada: " + os.path.basename(file_path))
             self._set_status("Imagen cargada correctamente")
     
+    def _on_roi_press(self, event):
+        if self.original_image is None:
+            return
+        self._roi_start = (event.x, event.y)
+        self.original_canvas.delete("roi")
+
+    def _on_roi_drag(self, event):
+        if self._roi_start is None:
+            return
+        self.original_canvas.delete("roi")
+        self.original_canvas.create_rectangle(
+            *self._roi_start, event.x, event.y,
+            outline="#f59e0b", width=2, dash=(4, 2), tags="roi",
+        )
+
+    def _on_roi_release(self, event):
+        """Convierte el rectángulo arrastrado a coordenadas de imagen y lo detecta."""
+        if self._roi_start is None:
+            return
+        (sx, sy), self._roi_start = self._roi_start, None
+        if self.original_image is None:
+            return
+        ax, ay = self._canvas_to_image(self.original_canvas, sx, sy)
+        bx, by = self._canvas_to_image(self.original_canvas, event.x, event.y)
+        # Recortar a la imagen: el lienzo tiene margen alrededor de la vista previa
+        height, width = self.original_image.shape[:2]
+        x0, x1 = (min(max(v, 0), width) for v in sorted((ax, bx)))
+        y0, y1 = (min(max(v, 0), height) for v in sorted((ay, by)))
+        if x1 - x0 < 4 or y1 - y0 < 4:
+            # Un clic sin arrastrar, o un arrastre fuera de la imagen, no es una región
+            self.original_canvas.delete("roi")
+            return
+        self.detect_region((int(x0), int(y0), int(np.ceil(x1 - x0)), int(np.ceil(y1 - y0))))
+
+    def _canvas_to_image(self, canvas, x, y):
+        preview = self._previews[canvas]
+        ox, oy = preview.offset
+        return (x - ox) / preview.scale, (y - oy) / preview.scale
+
+    def _shape_under_cursor(self, event):
+        """Posición en ``detection_result.shapes`` de la figura bajo el cursor, o ``None``."""
+        if self.detection_result is None or not self.detection_result.shapes:
+            return None
+        x, y = self._canvas_to_image(self.processed_canvas, event.x, event.y)
+        # Unos píxeles de pantalla de margen para poder elegir figuras finas
+        tolerance = 3 / self._previews[self.processed_canvas].scale
+        return self.detection_result.index.shape_at(x, y, tolerance)
+
+    def _on_canvas_motion(self, event):
+        index = self._shape_under_cursor(event)
+        self.overlay.hover(index)
+        self.processed_canvas.config(cursor="hand2" if index is not None else "")
+
+    def _on_canvas_click(self, event):
+        index = self._shape_under_cursor(event)
+        # Resaltar sólo lo que la tabla también muestra seleccionado
+        if self.table.select(index):
+            self.overlay.select(index)
+
     def display_image(self, cv_image, canvas):
         """Muestra una imagen en un canvas específico"""
-        # Convertir de BGR a RGB
-        cv_image_rgb = cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB)
-        
-        # Obtener dimensiones del canvas
-        canvas.update()
-        canvas_width = canvas.winfo_width()
-        canvas_height = canvas.winfo_height()
-        
-        # Redimensionar imagen manteniendo aspecto
-        h, w = cv_image_rgb.shape[:2]
-        scale = min(canvas_width / w, canvas_height / h) * 0.95
-        new_w, new_h = int(w * scale), int(h * scale)
-        
-        resized = cv2.resize(cv_image_rgb, (new_w, new_h), interpolation=cv2.INTER_AREA)
-        
-        # Convertir a formato PIL y mostrar
-        pil_image = Image.fromarray(resized)
-        photo = ImageTk.PhotoImage(pil_image)
-        
-        canvas.delete("all")
-        canvas.create_image(canvas_width // 2, canvas_height // 2, image=photo, anchor=tk.CENTER)
-        canvas.image = photo  # Mantener referencia
+        start = time.perf_counter()
+        self._previews[canvas].set_image(cv_image)
+        self.last_display_ms = (time.perf_counter() - start) * 1000
     
     def detect_shapes(self):
-        """Detecta figuras geométricas en la imagen y llena la tabla."""
+        """Lanza la detección en un hilo de fondo; una nueva detección reemplaza a la anterior."""
         if self.original_image is None:
             messagebox.showwarning("Advertencia", "Primero debes cargar una imagen")
             return
-        
+
+        image = self.original_image
+        params = self._current_params()
+        self._start_job("Procesando imagen...", lambda progress, cancel: self.detector.detect(
+            image, params, progress=progress, cancel=cancel))
+
+    def detect_region(self, roi):
+        """Vuelve a detectar sólo ``roi`` = ``(x, y, ancho, alto)`` y lo une al resultado actual."""
+        if self.original_image is None:
+            return
+
+        image = self.original_image
+        previous = self.detection_result
+        tiled = TiledDetector(self._current_params())
+        self._start_job("Procesando región...", lambda _progress, cancel: tiled.detect_roi(
+            image, roi, previous=previous, cancel=cancel))
+
+    def _start_job(self, status, run):
+        """Ejecuta ``run(progress, cancel)`` en un hilo de fondo."""
+        # Cancelar un trabajo anterior en lugar de encolarse detrás de él
+        self._invalidate_job()
+        job_id = self._job_id
+        cancel_event = threading.Event()
+        self._cancel_event = cancel_event
+
         # Limpiar resultados anteriores
-        self._set_status("Procesando imagen...")
+        self._set_status(status)
         self._clear_results_table()
         self.summary_var.set("Procesando...")
-        self.root.update_idletasks()
-        
-        # Crear copia de la imagen
-        image = self.original_image.copy()
-        
-        # Preprocesamiento
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        edges = cv2.Canny(blurred, 50, 150)
-        
-        # Encontrar contornos
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        shapes_list = []
-        
-        for i, contour in enumerate(contours):
-            # Filtrar contornos muy pequeños
-            area = cv2.contourArea(contour)
-            if area < 500:
-                continue
-            
-            # Aproximar el contorno
-            perimeter = cv2.arcLength(contour, True)
-            approx = cv2.approxPolyDP(contour, 0.04 * perimeter, True)
-            
-            # Calcular el centro del contorno
-            M = cv2.moments(contour)
-            if M["m00"] != 0:
-                cX = int(M["m10"] / M["m00"])
-                cY = int(M["m01"] / M["m00"])
-            else:
-                cX, cY = 0, 0
-            
-            # Identificar la figura según el número de vértices
-            vertices = len(approx)
-            shape_name = self.identify_shape(vertices, contour, approx)
-            
-            # Guardar información de la figura
-            shapes_list.append({
-                'numero': len(shapes_list) + 1,
-                'nombre': shape_name,
-                'area': area,
-                'vertices': vertices,
-                'centro': (cX, cY)
-            })
-            
-            # Dibujar el contorno y el número
-            color = self.get_color_for_shape(shape_name)
-            cv2.drawContours(image, [approx], -1, color, 3)
-            
-            # Añadir número de figura
-            cv2.putText(
-                image,
-                f"#{len(shapes_list)}",
-                (cX - 20, cY - 20),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.8,
-                color,
-                2
-            )
-            
-            # Añadir texto con el nombre de la figura
-            cv2.putText(
-                image,
-                shape_name,
-                (cX - 40, cY + 20),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.6,
-                color,
-                2
-            )
-        
-        # Mostrar imagen procesada
-        self.processed_image = image
-        self.display_image(image, self.processed_canvas)
-        
+        self.progress["value"] = 0
+        self.cancel_btn.config(state=tk.NORMAL)
+        self.save_btn.config(state=tk.DISABLED)
+
+        worker = threading.Thread(
+            target=self._detection_worker,
+            args=(job_id, run, cancel_event),
+            daemon=True
+        )
+        worker.start()
+
+        if self._poll_after_id is None:
+            self._poll_after_id = self.root.after(50, self._poll_worker_queue)
+
+    def _detection_worker(self, job_id, run, cancel_event):
+        """Ejecuta el motor fuera del hilo de Tk y publica mensajes en la cola."""
+        def progress(stage, fraction):
+            self._worker_queue.put((job_id, "progress", (stage, fraction)))
+
+        try:
+            result = run(progress, cancel_event)
+            # Índice espacial para el cursor, construido aquí y no en el hilo de Tk
+            result.index
+        except DetectionCancelled:
+            self._worker_queue.put((job_id, "cancelled", None))
+        except Exception as e:
+            self._worker_queue.put((job_id, "error", e))
+        else:
+            self._worker_queue.put((job_id, "done", result))
+
+    def _poll_worker_queue(self):
+        """Procesa en el hilo de Tk los mensajes enviados por el trabajador."""
+        self._poll_after_id = None
+        try:
+            while True:
+                job_id, kind, payload = self._worker_queue.get_nowait()
+                # Ignorar mensajes de trabajos reemplazados
+                if job_id != self._job_id:
+                    continue
+                if kind == "progress":
+                    stage, fraction = payload
+                    self.progress["value"] = fraction
+                    self._set_status(STAGE_LABELS.get(stage, stage))
+                elif kind == "done":
+                    self._finish_detection()
+                    self._show_detection_result(payload)
+                elif kind == "cancelled":
+                    self._finish_detection()
+                    self.summary_var.set("Detección cancelada")
+                    self._set_status("Detección cancelada")
+                elif kind == "error":
+                    self._finish_detection()
+                    self.summary_var.set("Sin resultados")
+                    self._set_status("Error durante la detección")
+                    messagebox.showerror("Error", f"No se pudo procesar la imagen: {payload}")
+        except queue.Empty:
+            pass
+
+        if self._cancel_event is not None:
+            self._poll_after_id = self.root.after(50, self._poll_worker_queue)
+
+    def _invalidate_job(self):
+        """Cancela el trabajo en curso y hace que se ignoren sus mensajes pendientes."""
+        if self._cancel_event is not None:
+            self._cancel_event.set()
+        self._job_id += 1
+        self._finish_detection()
+
+    def _finish_detection(self):
+        self._cancel_event = None
+        self.cancel_btn.config(state=tk.DISABLED)
+        self.progress["value"] = 0
+
+    def cancel_detection(self):
+        """Cancela la detección en curso, si la hay."""
+        if self._cancel_event is None:
+            return
+        self._cancel_event.set()
+        self.cancel_btn.config(state=tk.DISABLED)
+        self._set_status("Cancelando...")
+
+    def _show_detection_result(self, result):
+        """Muestra las figuras sobre la imagen y llena la tabla con un DetectionResult."""
+        shapes_list = result.shapes
+
+        # Mostrar la imagen original con las figuras como capa vectorial;
+        # la copia rasterizada se genera sólo al guardar
+        self.detection_result = result
+        self.processed_image = None
+        self.display_image(self.original_image, self.processed_canvas)
+        self.overlay.set_result(result)
+
         # Llenar tabla de resultados
         self.shapes_list = shapes_list
-        for shape in shapes_list:
-            self.tree.insert("", tk.END, values=(
-                shape['numero'],
-                shape['nombre'],
-                shape['vertices'],
-                f"{shape['area']:.0f}",
-                f"({shape['centro'][0]}, {shape['centro'][1]})"
-            ))
+        self.table.set_shapes(shapes_list)
+
+        # Métricas del pipeline y del dibujado para la barra de estado
+        metrics = ""
+        if result.stats is not None:
+            metrics = f" · {result.stats.summary()} · vista {self.last_display_ms:.1f} ms"
 
         total_shapes = len(shapes_list)
         if total_shapes > 0:
             self.summary_var.set(f"Total: {total_shapes} figura(s)")
             self.save_btn.config(state=tk.NORMAL)
-            self._set_status("Análisis completado")
+            self._set_status("Análisis completado" + metrics)
         else:
             self.summary_var.set("No se detectaron figuras. Prueba con mayor contraste.")
             self.save_btn.config(state=tk.DISABLED)
-            self._set_status("Sin resultados")
+            self._set_status("Sin resultados" + metrics)
     
+    def _on_table_select(self, index):
+        self.overlay.select(index)
+
+    def _on_toggle_labels(self):
+        self.overlay.set_show_labels(self.show_labels.get())
+
     def identify_shape(self, vertices, contour, approx):
         """Identifica el tipo de figura según sus características"""
-        if vertices == 3:
-            return "Triangulo"
-        
-        elif vertices == 4:
-            # Verificar si es cuadrado o rectángulo
-            x, y, w, h = cv2.boundingRect(approx)
-            aspect_ratio = float(w) / h
-            
-            if 0.95 <= aspect_ratio <= 1.05:
-                return "Cuadrado"
-            else:
-                return "Rectangulo"
-        
-        elif vertices == 5:
-            return "Pentagono"
-        
-        elif vertices == 6:
-            return "Hexagono"
-
-        elif vertices > 6:
-            # Verificar si es un círculo
-            area = cv2.contourArea(contour)
-            perimeter = cv2.arcLength(contour, True)
-            circularity = 4 * np.pi * area / (perimeter * perimeter)
-            
-            if circularity > 0.8:
-                return "Circulo"
-            else:
-                return f"Poligono ({vertices} lados)"
-
-        return "Figura desconocida"
+        return identify_shape(vertices, contour, approx)
     
     def get_color_for_shape(self, shape_name):
         """Asigna un color específico a cada tipo de figura"""
-        colors = {
-            "Triangulo": (0, 255, 0),      # Verde
-            "Cuadrado": (255, 0, 0),       # Azul
-            "Rectangulo": (0, 165, 255),   # Naranja
-            "Pentagono": (255, 0, 255),    # Magenta
-            "Hexagono": (255, 255, 0),     # Cian
-            "Circulo": (0, 0, 255),        # Rojo
-        }
-        
-        return colors.get(shape_name, (255, 255, 255))  # Blanco por defecto
+        return get_color_for_shape(shape_name)
     
     def clear_all(self):
         """Limpia todas las imágenes y resultados"""
-        self.original_canvas.delete("all")
-        self.processed_canvas.delete("all")
+        self._invalidate_job()
+        self.detector.clear()
+        for preview in self._previews.values():
+            preview.clear()
         self._clear_results_table()
         self.image_path = None
         self.original_image = None
         self.processed_image = None
+        self.detection_result = None
+        self.overlay.clear()
         self.detect_btn.config(state=tk.DISABLED)
         try:
             self._filemenu_detect_item.entryconfig(1, state=tk.DISABLED)
@@ -511,13 +1091,13 @@ class ShapeDetectorApp:
         self._set_status("Listo para cargar una nueva imagen.")
 
     def _clear_results_table(self):
-        for item in getattr(self, 'tree', []).get_children() if hasattr(self, 'tree') else []:
-            self.tree.delete(item)
+        if hasattr(self, 'table'):
+            self.table.clear()
         self.shapes_list = []
 
     def save_result(self):
         """Guardar la imagen procesada en disco"""
-        if self.processed_image is None:
+        if self.detection_result is None:
             messagebox.showinfo("Info", "No hay imagen procesada para guardar.")
             return
         initial = "resultado.png"
@@ -529,6 +1109,9 @@ class ShapeDetectorApp:
         )
         if out_path:
             ext = os.path.splitext(out_path)[1].lower()
+            # Rasterizar las anotaciones sólo ahora, bajo demanda
+            if self.processed_image is None:
+                self.processed_image = draw_annotations(self.original_image, self.detection_result)
             save_img = self.processed_image
             # Convert BGR to RGB for PIL save, but cv2.imwrite expects BGR; use cv2 for simplicity
             try:
@@ -537,8 +1120,36 @@ class ShapeDetectorApp:
             except Exception as e:
                 messagebox.showerror("Error", f"No se pudo guardar la imagen: {e}")
 
+    def export_results(self):
+        """Exportar figuras y contornos en JSONL, CSV o NPZ según la extensión"""
+        if self.detection_result is None:
+            messagebox.showinfo("Info", "No hay resultados para exportar.")
+            return
+        out_path = filedialog.asksaveasfilename(
+            title="Exportar resultados",
+            defaultextension=".jsonl",
+            initialfile="resultado.jsonl",
+            filetypes=[("JSON Lines", "*.jsonl"), ("CSV", "*.csv"), ("NumPy", "*.npz")]
+        )
+        if not out_path:
+            return
+        fmt = os.path.splitext(out_path)[1].lower().lstrip(".")
+        if fmt not in ("jsonl", "csv", "npz"):
+            fmt = "jsonl"
+        record = result_to_record(self.image_path, self.detection_result, include_contours=True)
+        try:
+            with open_exporter(fmt, out_path, include_contours=True) as exporter:
+                exporter.write(record)
+            # NPZ se escribe por bloques numerados (ver export.NpzExporter)
+            written = exporter.written if fmt == "npz" else [out_path]
+            self._set_status("Resultados exportados a "
+                             + ", ".join(os.path.basename(p) for p in written))
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudieron exportar los resultados: {e}")
+
 
 def main():
+    _load_gui()
     root = tk.Tk()
     app = ShapeDetectorApp(root)
     root.mainloop()
@@ -0,0 +1,157 @@
+"""Pipeline incremental para ajustar parámetros de forma interactiva.
+
+``IncrementalDetector`` guarda la salida de cada etapa (grises, pirámide,
+desenfoque, bordes, contornos, medidas y clasificación) junto con las entradas
+de las que depende, y sólo recalcula las etapas cuyas entradas han cambiado:
+
+* ``epsilon_factor`` o ``min_area``: sólo medidas y clasificación (salvo que en
+  modo pirámide cambie el nivel).
+* ``canny_low`` / ``canny_high``: bordes en adelante.
+* ``blur_kernel``: desenfoque en adelante.
+* Otra imagen: todo.
+"""
+import threading
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+
+from detector import (STAGES, DetectionCancelled, DetectionParams, DetectionResult, DetectionStats,
+                      ShapeDetector, choose_pyramid_level, draw_annotations,
+                      extract_features, is_binary_mask, mask_contours)
+
+
+class IncrementalDetector:
+    """Detector que reutiliza las etapas cuyas entradas no han cambiado.
+
+    Se puede llamar desde varios hilos: las detecciones se serializan, y una
+    detección cancelada conserva las etapas que llegó a completar.
+    """
+
+    def __init__(self, params=None, classifier=None):
+        self.params = params or DetectionParams()
+        # Igual que en ShapeDetector
+        self.classifier = classifier
+        self._image = None
+        self._stages = {}  # etapa -> (clave de sus entradas, salida)
+        self._lock = threading.Lock()
+        # ``clear`` incrementa ``_generation``; las etapas guardadas en una
+        # generación anterior se descartan en la siguiente detección
+        self._generation = 0
+        self._stages_generation = 0
+
+    def clear(self):
+        """Olvida la imagen actual y todas las etapas guardadas.
+
+        No espera a una detección en curso (se llama desde el hilo de la
+        interfaz): si la hay, sus etapas se descartan en la siguiente.
+        """
+        self._generation += 1
+        if self._lock.acquire(blocking=False):
+            try:
+                self._image = None
+                self._stages.clear()
+            finally:
+                self._lock.release()
+
+    def detect(self, image, params=None, annotate=False, progress=None, cancel=None):
+        """Como ``ShapeDetector.detect``; ``params`` reemplaza a ``self.params``.
+
+        La imagen se compara por identidad: pasar otro arreglo descarta todas
+        las etapas. ``stats.timings`` sólo incluye las etapas recalculadas y
+        ``stats.cache_hit`` indica que no se ha recalculado ninguna.
+        """
+        if image is None:
+            raise ValueError("La imagen es None")
+        with self._lock:
+            if params is not None:
+                self.params = params
+            if image is not self._image or self._stages_generation != self._generation:
+                self._image = image
+                self._stages.clear()
+                self._stages_generation = self._generation
+            return self._run(image, self.params, annotate, progress, cancel)
+
+    def _run(self, image, p, annotate, progress, cancel):
+        stats = DetectionStats()
+        total_stages = len(STAGES) if annotate else len(STAGES) - 1
+
+        def stage(name, timing, key, compute):
+            """Devuelve la salida guardada de ``name`` o la recalcula si ``key`` cambió."""
+            cached = self._stages.get(name)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+            if cancel is not None and cancel.is_set():
+                raise DetectionCancelled(timing)
+            if progress is not None:
+                progress(timing, STAGES.index(timing) / total_stages)
+            start = time.perf_counter()
+            out = compute()
+            stats.timings[timing] = stats.timings.get(timing, 0.0) + (time.perf_counter() - start) * 1000
+            if isinstance(out, np.ndarray):
+                stats.bytes_allocated += out.nbytes
+            self._stages[name] = (key, out)
+            return out
+
+        gray = stage("gris", "gris", (), lambda: (
+            cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image))
+
+        level = choose_pyramid_level(gray.shape, p.min_area) if p.pyramid else 0
+
+        def pyramid():
+            work = gray
+            for _ in range(level):
+                work = cv2.pyrDown(work)
+            return work
+
+        key = (level,)
+        work = stage("piramide", "gris", key, pyramid)
+
+        if p.mask_shortcut and stage("mascara", "contornos", key, lambda: is_binary_mask(work)):
+            key += ("mascara",)
+            contours = stage("contornos", "contornos", key, lambda: mask_contours(work))
+        else:
+            key += (p.blur_kernel,)
+            blurred = stage("desenfoque", "desenfoque", key, lambda: cv2.GaussianBlur(
+                work, (p.blur_kernel, p.blur_kernel), 0))
+            key += (p.canny_low, p.canny_high)
+            edges = stage("bordes", "bordes", key, lambda: cv2.Canny(
+                blurred, p.canny_low, p.canny_high))
+            contours = stage("contornos", "contornos", key, lambda: cv2.findContours(
+                edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0])
+
+        factor = 2 ** level
+
+        def measure():
+            features = extract_features(contours, p.epsilon_factor, p.min_area / factor ** 2,
+                                        cancel=cancel)
+            if level:
+                features = features.scaled(factor)
+                if p.refine:
+                    features = ShapeDetector(p)._refine(gray, features, factor, cancel)
+            return features
+
+        key += (p.epsilon_factor, p.min_area, p.refine)
+        features = stage("medidas", "clasificacion", key, measure)
+        names = stage("clasificacion", "clasificacion", key + (self.classifier,),
+                      lambda: ShapeDetector(p, classifier=self.classifier).classify(features))
+
+        result = DetectionResult.from_features(features, image.shape[:2], names)
+        result.pyramid_level = level
+        stats.contours_found = len(contours)
+        stats.contours_filtered = len(contours) - len(features)
+        stats.shapes_per_class = dict(Counter(names))
+
+        if annotate:
+            if progress is not None:
+                progress("anotacion", STAGES.index("anotacion") / total_stages)
+            start = time.perf_counter()
+            result.annotated = draw_annotations(image, result)
+            stats.timings["anotacion"] = (time.perf_counter() - start) * 1000
+
+        stats.cache_hit = not stats.timings
+        result.stats = stats
+        if progress is not None:
+            progress("listo", 1.0)
+        return result
@@ -0,0 +1,89 @@
+"""Captura de perfil (cProfile o tracemalloc) de una sola detección.
+
+Uso::
+
+    python profiling.py imagen.png                     # tiempos y contadores
+    python profiling.py imagen.png --mode cprofile     # + las 25 funciones más costosas
+    python profiling.py imagen.png --mode tracemalloc  # + las líneas que más memoria reservan
+
+Los tiempos por etapa y contadores salen de ``DetectionResult.stats`` y se
+imprimen como un registro JSON en stdout; el informe del perfilador va a stderr.
+"""
+import argparse
+import cProfile
+import io
+import json
+import pstats
+import sys
+import tracemalloc
+
+import cv2
+
+from detector import DetectionParams, ShapeDetector
+
+
+PROFILE_MODES = ("cprofile", "tracemalloc")
+
+
+def profile_detection(detector, image, mode, limit=25, **detect_kwargs):
+    """Ejecuta ``detector.detect`` una vez bajo el perfilador indicado.
+
+    Returns:
+        ``(DetectionResult, informe en texto)``.
+    """
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        result = profiler.runcall(detector.detect, image, **detect_kwargs)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+        return result, out.getvalue()
+
+    if mode == "tracemalloc":
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        try:
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+            result = detector.detect(image, **detect_kwargs)
+            after = tracemalloc.take_snapshot()
+            _current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+        lines = [f"Pico de memoria trazada: {peak / 1e6:.2f} MB"]
+        for stat in after.compare_to(before, "lineno")[:limit]:
+            lines.append(str(stat))
+        return result, "\n".join(lines) + "\n"
+
+    raise ValueError(f"Modo de perfil desconocido: {mode}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perfila una detección sobre una imagen.")
+    parser.add_argument("image")
+    parser.add_argument("--mode", choices=PROFILE_MODES, default=None)
+    parser.add_argument("--limit", type=int, default=25)
+    parser.add_argument("--annotate", action="store_true")
+    parser.add_argument("--pyramid", action="store_true")
+    args = parser.parse_args(argv)
+
+    image = cv2.imread(args.image)
+    if image is None:
+        print(f"No se pudo cargar la imagen: {args.image}", file=sys.stderr)
+        return 1
+
+    detector = ShapeDetector(DetectionParams(pyramid=args.pyramid))
+    if args.mode:
+        result, report = profile_detection(detector, image, args.mode, args.limit,
+                                           annotate=args.annotate)
+        sys.stderr.write(report)
+    else:
+        result = detector.detect(image, annotate=args.annotate)
+
+    print(json.dumps({"path": args.image, "stats": result.stats.as_dict()}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
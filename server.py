@@ -0,0 +1,351 @@
+"""Servicio HTTP local de detección (sólo biblioteca estándar + OpenCV).
+
+Uso::
+
+    python server.py --port 8765 -j 4
+
+Endpoints:
+
+* ``POST /detect``: el cuerpo es la imagen codificada (PNG, JPEG...) o un JSON
+  ``{"path": "/ruta/imagen.png"}``. Devuelve ``{"shapes": [...], ...}``.
+* ``GET /health``: estado del servicio (503 mientras se reinicia el pool).
+* ``GET /metrics``: contadores, profundidad de la cola y latencias p50/p99.
+
+Las peticiones entran en una cola acotada (si está llena se responde 503) y un
+agrupador junta las que llegan con menos de ``batch_window`` segundos de
+diferencia en un solo envío al ``ProcessPoolExecutor``. Si un trabajador muere,
+el lote en curso recibe 503 y el pool se sustituye por uno nuevo.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_all_start_methods, get_context
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+
+from detector import DetectionParams, ShapeDetector, decode_for_detection, read_for_detection
+from export import result_to_record
+
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+_worker_detector = None
+
+
+def _init_worker(params):
+    global _worker_detector
+    cv2.setNumThreads(1)
+    _worker_detector = ShapeDetector(params)
+
+
+def _ping():
+    return True
+
+
+def _detect_one(payload):
+    kind, data = payload
+    params = _worker_detector.params
+    if kind == "path":
+        gray, factor = read_for_detection(data, params)
+    else:
+        gray, factor = decode_for_detection(data, params)
+    if gray is None:
+        return {"ok": False, "error": "No se pudo decodificar la imagen"}
+    record = result_to_record(data if kind == "path" else None,
+                              _worker_detector.detect(gray, scale=factor))
+    if kind != "path":
+        del record["path"]
+    return record
+
+
+def detect_batch(payloads):
+    """Procesa un lote de peticiones en un trabajador; un fallo no afecta al resto."""
+    out = []
+    for payload in payloads:
+        try:
+            out.append(_detect_one(payload))
+        except Exception as e:
+            out.append({"ok": False, "error": str(e)})
+    return out
+
+
+class DetectionService:
+    """Servidor HTTP asyncio con cola acotada, micro-lotes y pool de procesos."""
+
+    def __init__(self, host="127.0.0.1", port=8765, workers=None, params=None,
+                 max_queue=64, batch_size=8, batch_window=0.005, max_body=64 * 1024 * 1024):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.params = params or DetectionParams()
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_body = max_body
+
+        self._queue = None
+        self._pool = None
+        self._pool_ready = False
+        self._server = None
+        self._batcher = None
+        self._slots = None
+        self._latencies = deque(maxlen=2048)
+        self.counters = {"requests": 0, "detections": 0, "rejected": 0, "errors": 0, "batches": 0,
+                         "pool_restarts": 0}
+
+    # -- ciclo de vida ----------------------------------------------------
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._slots = asyncio.Semaphore(self.workers)
+        self._pool = self._new_pool()
+        # Arrancar los trabajadores antes de abrir el socket: así el primer
+        # lote no paga la inicialización
+        await asyncio.get_running_loop().run_in_executor(self._pool, _ping)
+        self._pool_ready = True
+        self._batcher = asyncio.create_task(self._batch_loop())
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        # Con port=0 el sistema elige uno libre
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def _new_pool(self):
+        """Pool de trabajadores creados desde un proceso limpio.
+
+        Con ``fork`` los trabajadores que se lanzan bajo demanda heredarían los
+        sockets de los clientes abiertos en ese momento y éstos no verían nunca
+        el cierre de la conexión; ``forkserver`` (o ``spawn``) lo evita.
+        """
+        method = "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context(method),
+                                   initializer=_init_worker, initargs=(self.params,))
+
+    async def _restart_pool(self, pool):
+        """Sustituye un pool roto; lo que tuviera en vuelo termina con error.
+
+        Returns:
+            El pool en uso (el nuevo, o el que ya lo sustituyó antes).
+        """
+        if pool is self._pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.counters["pool_restarts"] += 1
+            print("Un trabajador terminó de forma inesperada; se reinicia el pool", file=sys.stderr)
+            self._pool_ready = False
+            self._pool = self._new_pool()
+            try:
+                await asyncio.get_running_loop().run_in_executor(self._pool, _ping)
+            finally:
+                self._pool_ready = True
+        return self._pool
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    # -- agrupación -------------------------------------------------------
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # No enviar más lotes que procesos: el resto espera en la cola
+            await self._slots.acquire()
+            self.counters["batches"] += 1
+            asyncio.create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        payloads = [p for p, _ in batch]
+        pool = self._pool
+        try:
+            try:
+                pending = loop.run_in_executor(pool, detect_batch, payloads)
+            except BrokenProcessPool:
+                # El pool ya estaba roto antes de este lote: reintentar en uno nuevo
+                pool = await self._restart_pool(pool)
+                pending = loop.run_in_executor(pool, detect_batch, payloads)
+            results = await pending
+        except BrokenProcessPool:
+            # El lote pudo causar la caída; no se reintenta para no repetirla
+            await self._restart_pool(pool)
+            results = [{"ok": False, "status": 503,
+                        "error": "Un trabajador terminó de forma inesperada"}] * len(batch)
+        except Exception as e:
+            results = [{"ok": False, "status": 500, "error": str(e)}] * len(batch)
+        finally:
+            self._slots.release()
+        for (_payload, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    # -- HTTP -------------------------------------------------------------
+
+    async def _handle(self, reader, writer):
+        start = time.perf_counter()
+        try:
+            status, body = await self._dispatch(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except Exception as e:
+            self.counters["errors"] += 1
+            status, body = 500, {"error": str(e)}
+
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n"
+        )
+        if status == 503:
+            head = head[:-2] + "Retry-After: 1\r\n\r\n"
+        try:
+            writer.write(head.encode("latin-1") + data)
+            await writer.drain()
+        finally:
+            writer.close()
+        if status == 200 and body.get("shapes") is not None:
+            self._latencies.append(time.perf_counter() - start)
+
+    async def _dispatch(self, reader):
+        request_line = await reader.readline()
+        parts = request_line.decode("latin-1").split()
+        if len(parts) != 3:
+            return 400, {"error": "Petición mal formada"}
+        method, target, _version = parts
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        self.counters["requests"] += 1
+        path = urlsplit(target).path
+
+        if path == "/health":
+            if not self._pool_ready:
+                return 503, {"status": "restarting", "workers": self.workers}
+            return 200, {"status": "ok", "workers": self.workers,
+                         "pool_restarts": self.counters["pool_restarts"]}
+        if path == "/metrics":
+            return 200, self.metrics()
+        if path != "/detect":
+            return 404, {"error": "Ruta desconocida"}
+        if method != "POST":
+            return 405, {"error": "Usa POST"}
+
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            return 400, {"error": "Content-Length no válido"}
+        if not length:
+            return 400, {"error": "Falta el cuerpo de la petición"}
+        if length > self.max_body:
+            return 413, {"error": "Imagen demasiado grande"}
+        body = await reader.readexactly(length)
+
+        if headers.get("content-type", "").startswith("application/json"):
+            try:
+                payload = ("path", json.loads(body)["path"])
+            except (ValueError, KeyError, TypeError):
+                return 400, {"error": "Se esperaba {\"path\": ...}"}
+        else:
+            payload = ("bytes", body)
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((payload, future))
+        except asyncio.QueueFull:
+            self.counters["rejected"] += 1
+            return 503, {"error": "Servicio saturado, reintenta más tarde"}
+
+        result = await future
+        if not result.get("ok"):
+            # Fallos de la imagen: 400; fallos del pool: el estado que traiga
+            self.counters["errors"] += 1
+            return result.get("status", 400), {"error": result.get("error")}
+        self.counters["detections"] += 1
+        return 200, result
+
+    def metrics(self):
+        lat = np.array(self._latencies) * 1000
+        return {
+            **self.counters,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_limit": self.max_queue,
+            "latency_ms": {
+                "p50": round(float(np.percentile(lat, 50)), 3) if len(lat) else None,
+                "p99": round(float(np.percentile(lat, 99)), 3) if len(lat) else None,
+                "samples": int(len(lat)),
+            },
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servicio HTTP local de detección de figuras.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--max-queue", type=int, default=64,
+                        help="Peticiones en espera antes de responder 503")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--batch-window-ms", type=float, default=5.0)
+    parser.add_argument("--min-area", type=float, default=DetectionParams().min_area)
+    args = parser.parse_args(argv)
+
+    service = DetectionService(
+        args.host, args.port, workers=args.workers,
+        params=DetectionParams(min_area=args.min_area),
+        max_queue=args.max_queue, batch_size=args.batch_size,
+        batch_window=args.batch_window_ms / 1000,
+    )
+    print(f"Escuchando en http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+"""Pipeline multiproceso de decodificación y detección sobre memoria compartida.
+
+Uso::
+
+    python shared_pipeline.py imagenes/ --decoders 2 --detectors 6 -o resultados.jsonl
+
+Los procesos decodificadores leen cada imagen (en grises, con
+``read_for_detection``) y la copian en una ranura libre de un anillo de bloques
+``multiprocessing.shared_memory``; por la cola sólo viaja el número de ranura y
+la forma del arreglo. Los detectores ven la ranura como un arreglo NumPy sin
+copiarla, ejecutan ``ShapeDetector.detect``, liberan la ranura y devuelven sólo
+el registro de resultados (ver ``export.result_to_record``). Así decodificación
+y detección se solapan en varios núcleos sin serializar los píxeles.
+
+El número de ranuras acota la memoria: si los detectores van por detrás, los
+decodificadores esperan a que se libere una. Una imagen mayor que una ranura
+se envía por la cola como en ``multiprocessing`` normal (se cuenta en
+``inline`` en el resumen); como mucho hay una de éstas en vuelo por detector,
+así que tampoco hacen crecer la memoria sin límite.
+
+Las ranuras viven en ``/dev/shm``: por defecto son 2 por proceso de 48 MB cada
+una (1,5 GB con 16 procesos). Si no caben en el espacio libre de ``/dev/shm``
+se usan menos, y ``--slot-mb`` las ajusta al tamaño real de las imágenes (un
+fotograma 4K en grises ocupa unos 8 MB).
+"""
+import argparse
+import os
+import queue
+import shutil
+import sys
+import time
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import cv2
+import numpy as np
+
+from batch import iter_image_paths
+from detector import DetectionParams, ShapeDetector, read_for_detection
+from export import EXPORT_FORMATS, open_exporter, result_to_record
+from templates import TemplateClassifier
+
+
+# Una imagen 8K en grises (7680 x 4320) cabe con holgura
+DEFAULT_SLOT_BYTES = 48 * 1024 * 1024
+
+
+def _attach(names):
+    return [SharedMemory(name=name) for name in names]
+
+
+def _decoder_loop(tasks, free, ready, results, slot_names, params, inline_slots):
+    """Proceso decodificador: ruta -> ranura de memoria compartida."""
+    cv2.setNumThreads(1)
+    slots = _attach(slot_names)
+    try:
+        while True:
+            path = tasks.get()
+            if path is None:
+                break
+            start = time.perf_counter()
+            try:
+                gray, factor = read_for_detection(path, params)
+            except Exception as e:
+                results.put({"path": path, "ok": False, "error": str(e)})
+                continue
+            if gray is None:
+                results.put({"path": path, "ok": False, "error": "No se pudo cargar la imagen"})
+                continue
+            gray = np.ascontiguousarray(gray)
+
+            if gray.nbytes > slots[0].size:
+                # Las imágenes que no caben también esperan turno, en su propio cupo
+                inline_slots.acquire()
+                ready.put((path, None, gray.shape, factor, time.perf_counter() - start, gray))
+                continue
+            # Esperar ranura libre: es la contrapresión del pipeline
+            slot = free.get()
+            np.ndarray(gray.shape, np.uint8, buffer=slots[slot].buf)[...] = gray
+            ready.put((path, slot, gray.shape, factor, time.perf_counter() - start, None))
+    finally:
+        for shm in slots:
+            shm.close()
+
+
+def _detector_loop(ready, free, results, slot_names, params, classifier, include_contours,
+                   inline_slots):
+    """Proceso detector: ranura -> registro de resultados."""
+    cv2.setNumThreads(1)
+    detector = ShapeDetector(params, classifier=classifier)
+    slots = _attach(slot_names)
+    try:
+        while True:
+            item = ready.get()
+            if item is None:
+                break
+            path, slot, shape, factor, decode_seconds, frame = item
+            start = time.perf_counter()
+            try:
+                if frame is None:
+                    frame = np.ndarray(shape, np.uint8, buffer=slots[slot].buf)
+                result = detector.detect(frame, scale=factor)
+                record = result_to_record(path, result, include_contours=include_contours)
+                record["seconds"] = round(decode_seconds + time.perf_counter() - start, 6)
+                record["stats"] = result.stats.as_dict()
+                record["inline"] = slot is None
+            except Exception as e:
+                record = {"path": path, "ok": False, "error": str(e)}
+            finally:
+                # Soltar la vista antes de devolver la ranura
+                frame = None
+                if slot is not None:
+                    free.put(slot)
+                else:
+                    inline_slots.release()
+            results.put(record)
+    finally:
+        for shm in slots:
+            shm.close()
+
+
+def _shm_free_bytes():
+    """Espacio libre en ``/dev/shm`` (sin límite conocido en otros sistemas)."""
+    try:
+        return shutil.disk_usage("/dev/shm").free
+    except OSError:
+        return sys.maxsize
+
+
+def run_pipeline(paths, exporter, params=None, decoders=None, detectors=None, slots=None,
+                 slot_bytes=DEFAULT_SLOT_BYTES, include_contours=False, classifier=None):
+    """Procesa ``paths`` con decodificadores y detectores separados, como ``batch.run_batch``.
+
+    ``slots`` (por defecto, un par por proceso) ranuras de ``slot_bytes`` cada
+    una se reservan en memoria compartida durante la ejecución; sin ``slots``
+    explícito se reducen para caber en el espacio libre de ``/dev/shm``.
+
+    Returns:
+        dict con el resumen (imágenes, fallos, en línea, segundos, imágenes/s).
+    """
+    params = params or DetectionParams()
+    cpus = os.cpu_count() or 1
+    decoders = decoders or max(1, cpus // 4)
+    detectors = detectors or max(1, cpus - decoders)
+    if not slots:
+        slots = 2 * (decoders + detectors)
+        slots = min(slots, max(1, _shm_free_bytes() // 2 // slot_bytes))
+
+    ctx = get_context()
+    tasks = ctx.Queue(maxsize=2 * decoders)
+    free = ctx.Queue()
+    ready = ctx.Queue()
+    results = ctx.Queue()
+    inline_slots = ctx.Semaphore(detectors)
+
+    blocks = [SharedMemory(create=True, size=slot_bytes) for _ in range(slots)]
+    names = [shm.name for shm in blocks]
+    for i in range(slots):
+        free.put(i)
+
+    procs = [ctx.Process(target=_decoder_loop,
+                         args=(tasks, free, ready, results, names, params, inline_slots),
+                         daemon=True) for _ in range(decoders)]
+    procs += [ctx.Process(target=_detector_loop,
+                          args=(ready, free, results, names, params, classifier, include_contours,
+                                inline_slots),
+                          daemon=True) for _ in range(detectors)]
+
+    processed = failed = inline = 0
+    submitted = 0
+    start = time.perf_counter()
+
+    def check_alive():
+        for p in procs:
+            if p.exitcode not in (None, 0):
+                raise RuntimeError(f"Un proceso del pipeline terminó con código {p.exitcode}")
+
+    def collect(timeout):
+        nonlocal processed, failed, inline
+        try:
+            record = results.get(timeout=timeout) if timeout else results.get_nowait()
+        except queue.Empty:
+            check_alive()
+            return False
+        processed += 1
+        if not record["ok"]:
+            failed += 1
+        elif record.pop("inline"):
+            inline += 1
+        exporter.write(record)
+        return True
+
+    try:
+        for p in procs:
+            p.start()
+
+        for path in paths:
+            while True:
+                while collect(0):
+                    pass
+                try:
+                    tasks.put(path, timeout=0.1)
+                    break
+                except queue.Full:
+                    check_alive()
+            submitted += 1
+
+        for _ in range(decoders):
+            tasks.put(None)
+        while processed < submitted:
+            collect(0.5)
+        for _ in range(detectors):
+            ready.put(None)
+        for p in procs:
+            p.join()
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    elapsed = time.perf_counter() - start
+    return {
+        "images": processed,
+        "failed": failed,
+        "inline": inline,
+        "seconds": elapsed,
+        "images_per_sec": processed / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Detecta figuras con decodificadores y detectores sobre memoria compartida."
+    )
+    parser.add_argument("inputs", nargs="+", help="Directorios, archivos o patrones glob")
+    parser.add_argument("-o", "--output", help="Archivo de salida (por defecto stdout)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="jsonl")
+    parser.add_argument("--contours", action="store_true",
+                        help="Incluir los polígonos en la salida JSONL")
+    parser.add_argument("-r", "--recursive", action="store_true")
+    parser.add_argument("--decoders", type=int, default=None,
+                        help="Procesos decodificadores (por defecto, 1/4 de los núcleos)")
+    parser.add_argument("--detectors", type=int, default=None,
+                        help="Procesos detectores (por defecto, el resto de núcleos)")
+    parser.add_argument("--slots", type=int, default=None,
+                        help="Ranuras de memoria compartida (por defecto 2 x procesos, "
+                             "limitadas por el espacio libre en /dev/shm)")
+    parser.add_argument("--slot-mb", type=int, default=DEFAULT_SLOT_BYTES // (1024 * 1024),
+                        help="Tamaño de cada ranura (MB)")
+    parser.add_argument("--min-area", type=float, default=DetectionParams().min_area)
+    parser.add_argument("--pyramid", action="store_true",
+                        help="Decodificar y detectar a escala reducida")
+    parser.add_argument("--templates", default=None,
+                        help="Índice .npz o directorio de plantillas (ver templates.py)")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.format == "npz" and not args.output:
+        print("El formato npz necesita -o/--output", file=sys.stderr)
+        return 2
+
+    classifier = TemplateClassifier.load(args.templates) if args.templates else None
+    exporter = open_exporter(args.format, args.output or sys.stdout,
+                             include_contours=args.contours)
+    try:
+        summary = run_pipeline(
+            iter_image_paths(args.inputs, recursive=args.recursive), exporter,
+            DetectionParams(min_area=args.min_area, pyramid=args.pyramid),
+            decoders=args.decoders, detectors=args.detectors, slots=args.slots,
+            slot_bytes=args.slot_mb * 1024 * 1024,
+            include_contours=args.contours or args.format == "npz", classifier=classifier,
+        )
+    finally:
+        exporter.close()
+
+    print(
+        f"Procesadas: {summary['images']} | Fallos: {summary['failed']} | "
+        f"En línea: {summary['inline']} | {summary['seconds']:.2f} s | "
+        f"{summary['images_per_sec']:.1f} imágenes/s",
+        file=sys.stderr,
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
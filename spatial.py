@@ -0,0 +1,83 @@
+"""Índice espacial de figuras detectadas.
+
+``ShapeIndex`` reparte los rectángulos envolventes de los contornos en una
+rejilla uniforme, de modo que "qué figura hay bajo el cursor" y "qué figuras
+hay en este rectángulo" sólo examinan las figuras de las celdas afectadas en
+lugar de recorrer toda la lista. Se construye una vez por detección (ver
+``DetectionResult.index``).
+"""
+import cv2
+import numpy as np
+
+
+class ShapeIndex:
+    """Rejilla uniforme sobre los rectángulos ``(x, y, ancho, alto)`` de los contornos.
+
+    El lado de celda por defecto es el lado mediano de los rectángulos, así que
+    una figura típica ocupa como mucho cuatro celdas.
+    """
+
+    def __init__(self, contours, cell_size=None):
+        self.contours = list(contours)
+        n = len(self.contours)
+        self.bbox = np.array([cv2.boundingRect(c) for c in self.contours],
+                             dtype=np.int64).reshape(n, 4)
+        x0, y0 = self.bbox[:, 0], self.bbox[:, 1]
+        x1, y1 = x0 + self.bbox[:, 2], y0 + self.bbox[:, 3]
+        self._box_area = self.bbox[:, 2] * self.bbox[:, 3]
+
+        if cell_size is None:
+            cell_size = float(np.median(np.maximum(self.bbox[:, 2], self.bbox[:, 3]))) if n else 1.0
+        self.cell_size = max(int(cell_size), 1)
+
+        # Celdas como listas de índices; cada figura se apunta en todas las que toca
+        c = self.cell_size
+        self._cells = {}
+        for i, (cx0, cy0, cx1, cy1) in enumerate(zip(
+                (x0 // c).tolist(), (y0 // c).tolist(), (x1 // c).tolist(), (y1 // c).tolist())):
+            for gy in range(cy0, cy1 + 1):
+                for gx in range(cx0, cx1 + 1):
+                    self._cells.setdefault((gx, gy), []).append(i)
+
+    def __len__(self):
+        return len(self.contours)
+
+    def _candidates(self, x0, y0, x1, y1):
+        c = self.cell_size
+        found = []
+        for gy in range(int(y0) // c, int(y1) // c + 1):
+            for gx in range(int(x0) // c, int(x1) // c + 1):
+                found.extend(self._cells.get((gx, gy), ()))
+        return np.unique(np.array(found, dtype=np.int64))
+
+    def query_region(self, x, y, w, h, contained=False):
+        """Índices de las figuras cuyo rectángulo corta ``(x, y, w, h)``.
+
+        Con ``contained`` sólo las que quedan enteras dentro. Los índices están
+        en orden creciente.
+        """
+        x1, y1 = x + w, y + h
+        idx = self._candidates(x, y, x1, y1)
+        if not len(idx):
+            return idx
+        bx0, by0 = self.bbox[idx, 0], self.bbox[idx, 1]
+        bx1, by1 = bx0 + self.bbox[idx, 2], by0 + self.bbox[idx, 3]
+        if contained:
+            keep = (bx0 >= x) & (by0 >= y) & (bx1 <= x1) & (by1 <= y1)
+        else:
+            keep = (bx0 <= x1) & (by0 <= y1) & (bx1 >= x) & (by1 >= y)
+        return idx[keep]
+
+    def shape_at(self, x, y, tolerance=0.0):
+        """Índice de la figura bajo el punto ``(x, y)`` o ``None``.
+
+        Un punto vale si está dentro del polígono o a menos de ``tolerance`` px
+        de su borde; si hay varias (figuras anidadas) gana la de menor rectángulo.
+        """
+        t = tolerance
+        best, best_area = None, None
+        for i in self.query_region(x - t, y - t, 2 * t, 2 * t).tolist():
+            d = cv2.pointPolygonTest(self.contours[i], (float(x), float(y)), True)
+            if d >= -t and (best is None or self._box_area[i] < best_area):
+                best, best_area = i, self._box_area[i]
+        return best
@@ -0,0 +1,306 @@
+"""Modo en tiempo real para vídeo y cámaras.
+
+Uso::
+
+    python stream.py 0 --fps 30 --show        # cámara 0
+    python stream.py video.mp4 -o frames.jsonl
+
+Los búferes de gris, desenfoque y bordes se reservan una vez y se reutilizan en
+cada fotograma. Si el procesamiento va por detrás del objetivo de FPS se
+descartan fotogramas con ``grab()`` (sin decodificarlos). Cada figura conserva su
+``numero`` entre fotogramas gracias a ``ShapeTracker``.
+"""
+import argparse
+import json
+import sys
+import time
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+from detector import (DetectionParams, DetectionResult, classify_features, draw_annotations,
+                      extract_features)
+
+
+@dataclass
+class FrameResult:
+    """Resultado de un fotograma del flujo."""
+    index: int
+    latency: float          # segundos de detección + seguimiento
+    skipped: int            # fotogramas descartados antes de éste
+    result: DetectionResult
+
+
+class ShapeTracker:
+    """Asigna identificadores estables a las figuras entre fotogramas.
+
+    Cada figura se empareja con la pista viva más cercana del mismo tipo cuyo
+    centro esté a menos de ``max_distance`` px. Las pistas que no se ven durante
+    ``max_missing`` fotogramas se olvidan.
+    """
+
+    def __init__(self, max_distance=50.0, max_missing=10):
+        self.max_distance = max_distance
+        self.max_missing = max_missing
+        self._next_id = 1
+        self._ids = np.empty(0, dtype=np.int64)
+        self._centers = np.empty((0, 2), dtype=np.float64)
+        # Tipo de cada pista como código entero (ver ``_codes``)
+        self._classes = np.empty(0, dtype=np.int64)
+        self._codes = {}
+        self._missing = np.empty(0, dtype=np.int64)
+
+    def reset(self):
+        self.__init__(self.max_distance, self.max_missing)
+
+    def _candidates(self, centers, classes):
+        """Parejas (figura, pista) del mismo tipo a menos de ``max_distance`` px.
+
+        Las pistas se agrupan en celdas de ``max_distance`` de lado por tipo y
+        cada figura sólo se compara con las de su celda y las ocho vecinas, así
+        que el coste crece con las parejas cercanas y no con ``n * m``.
+
+        Returns:
+            ``(i, j, dist)`` ordenados por distancia creciente.
+        """
+        size = self.max_distance if self.max_distance > 0 else 1.0
+        cells = np.floor(centers / size).astype(np.int64)
+        track_cells = np.floor(self._centers / size).astype(np.int64)
+        low = np.minimum(cells.min(axis=0), track_cells.min(axis=0)) - 1
+        span = np.maximum(cells.max(axis=0), track_cells.max(axis=0)) - low + 2
+
+        def keys(c, cell):
+            return (c * span[1] + (cell[:, 1] - low[1])) * span[0] + (cell[:, 0] - low[0])
+
+        track_keys = keys(self._classes, track_cells)
+        order = np.argsort(track_keys, kind="stable")
+        sorted_keys = track_keys[order]
+        rows, cols = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                query = keys(classes, cells + (dx, dy))
+                first = np.searchsorted(sorted_keys, query, side="left")
+                counts = np.searchsorted(sorted_keys, query, side="right") - first
+                total = int(counts.sum())
+                if not total:
+                    continue
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                rows.append(np.repeat(np.arange(len(centers)), counts))
+                cols.append(order[np.repeat(first, counts) + offsets])
+        if not rows:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0)
+
+        i, j = np.concatenate(rows), np.concatenate(cols)
+        dist = np.linalg.norm(centers[i] - self._centers[j], axis=1)
+        close = dist <= self.max_distance
+        i, j, dist = i[close], j[close], dist[close]
+        # Mismo orden que un argsort de la matriz completa: distancia, luego fila y columna
+        ranked = np.lexsort((j, i, dist))
+        return i[ranked], j[ranked], dist[ranked]
+
+    def update(self, centers, names):
+        """Devuelve un id por figura (mismo orden que ``centers``)."""
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        classes = np.array([self._codes.setdefault(name, len(self._codes)) for name in names],
+                           dtype=np.int64)
+        n, m = len(centers), len(self._ids)
+        assigned = np.zeros(n, dtype=np.int64)
+        matched = np.full(n, -1, dtype=np.int64)
+        matched_tracks = np.zeros(m, dtype=bool)
+
+        if n and m:
+            # Emparejamiento voraz por distancia creciente
+            rows, cols, _ = self._candidates(centers, classes)
+            for i, j in zip(rows.tolist(), cols.tolist()):
+                if matched[i] >= 0 or matched_tracks[j]:
+                    continue
+                matched[i] = j
+                matched_tracks[j] = True
+
+        # Actualizar pistas emparejadas y envejecer las demás
+        found = np.flatnonzero(matched >= 0)
+        assigned[found] = self._ids[matched[found]]
+        self._centers[matched[found]] = centers[found]
+        self._missing[matched_tracks] = 0
+        self._missing[~matched_tracks] += 1
+
+        alive = self._missing <= self.max_missing
+        self._ids = self._ids[alive]
+        self._centers = self._centers[alive]
+        self._classes = self._classes[alive]
+        self._missing = self._missing[alive]
+
+        # Pistas nuevas para las figuras sin pareja
+        new = np.flatnonzero(matched < 0)
+        if len(new):
+            new_ids = np.arange(self._next_id, self._next_id + len(new))
+            self._next_id += len(new)
+            assigned[new] = new_ids
+            self._ids = np.concatenate([self._ids, new_ids])
+            self._centers = np.concatenate([self._centers, centers[new]])
+            self._classes = np.concatenate([self._classes, classes[new]])
+            self._missing = np.concatenate([self._missing, np.zeros(len(new), dtype=np.int64)])
+
+        return assigned.tolist()
+
+
+class StreamDetector:
+    """Detector de fotogramas consecutivos con búferes reutilizados."""
+
+    def __init__(self, params=None, tracker=None):
+        self.params = params or DetectionParams()
+        self.tracker = tracker or ShapeTracker()
+        self._shape = None
+        self._gray = self._blurred = self._edges = None
+
+    def _ensure_buffers(self, shape):
+        if shape != self._shape:
+            self._shape = shape
+            self._gray = np.empty(shape, dtype=np.uint8)
+            self._blurred = np.empty(shape, dtype=np.uint8)
+            self._edges = np.empty(shape, dtype=np.uint8)
+
+    def detect(self, frame, annotate=False):
+        """Detecta figuras en ``frame`` y asigna ids estables a ``numero``."""
+        p = self.params
+        self._ensure_buffers(frame.shape[:2])
+
+        if frame.ndim == 3:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray)
+            gray = self._gray
+        else:
+            gray = frame
+        cv2.GaussianBlur(gray, (p.blur_kernel, p.blur_kernel), 0, dst=self._blurred)
+        cv2.Canny(self._blurred, p.canny_low, p.canny_high, edges=self._edges)
+        contours, _ = cv2.findContours(self._edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        features = extract_features(contours, p.epsilon_factor, p.min_area)
+        names = classify_features(features)
+        result = DetectionResult.from_features(features, frame.shape[:2], names)
+
+        ids = self.tracker.update(features.centroid, names)
+        for shape, shape_id in zip(result.shapes, ids):
+            shape['numero'] = shape_id
+
+        if annotate:
+            result.annotated = draw_annotations(frame, result)
+        return result
+
+
+def open_capture(source):
+    """Abre una cámara (índice entero o cadena numérica) o un archivo de vídeo."""
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise ValueError(f"No se pudo abrir la fuente de vídeo: {source}")
+    return cap
+
+
+def iter_stream(cap, detector, target_fps=None, annotate=False, max_frames=None):
+    """Procesa fotogramas de ``cap`` y genera un ``FrameResult`` por cada uno.
+
+    Con ``target_fps`` se descartan los fotogramas que no se alcanzarían a
+    procesar a tiempo, de modo que el flujo no acumula retraso. El retraso se
+    mide con el periodo completo del bucle: lectura, detección y el tiempo que
+    el consumidor tarda en pedir el siguiente fotograma (dibujar, exportar...).
+    """
+    budget = 1.0 / target_fps if target_fps else 0.0
+    frame = None
+    index = -1
+    skipped = 0
+    processed = 0
+    lag = 0.0  # segundos de retraso acumulado respecto a ``target_fps``
+    last = time.perf_counter()
+
+    while max_frames is None or processed < max_frames:
+        # cap.read reutiliza ``frame`` cuando el tamaño coincide
+        ok, frame = cap.read(frame)
+        if not ok:
+            break
+        index += 1
+
+        start = time.perf_counter()
+        result = detector.detect(frame, annotate=annotate)
+        latency = time.perf_counter() - start
+
+        yield FrameResult(index=index, latency=latency, skipped=skipped, result=result)
+        processed += 1
+
+        # Contrapresión: saltar los fotogramas que llegaron mientras se
+        # procesaba éste y el consumidor lo usaba
+        now = time.perf_counter()
+        period, last = now - last, now
+        skipped = 0
+        if budget:
+            lag = max(lag + period - budget, 0.0)
+            for _ in range(int(lag / budget)):
+                if not cap.grab():
+                    return
+                index += 1
+                skipped += 1
+            lag -= skipped * budget
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Detecta figuras geométricas en vídeo o cámara en tiempo real."
+    )
+    parser.add_argument("source", help="Índice de cámara (0, 1, ...) o archivo de vídeo")
+    parser.add_argument("--fps", type=float, default=None,
+                        help="FPS objetivo; se descartan fotogramas si el proceso va retrasado")
+    parser.add_argument("-o", "--output", help="Archivo JSONL con un registro por fotograma")
+    parser.add_argument("--show", action="store_true", help="Mostrar una ventana con las anotaciones")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--min-area", type=float, default=DetectionParams().min_area)
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    cap = open_capture(args.source)
+    detector = StreamDetector(DetectionParams(min_area=args.min_area))
+    out = open(args.output, "w", encoding="utf-8") if args.output else None
+
+    latencies = []
+    dropped = 0
+    try:
+        for frame in iter_stream(cap, detector, args.fps, annotate=args.show,
+                                 max_frames=args.max_frames):
+            latencies.append(frame.latency)
+            dropped += frame.skipped
+            if out is not None:
+                out.write(json.dumps({
+                    "frame": frame.index,
+                    "latency_ms": round(frame.latency * 1000, 3),
+                    "skipped": frame.skipped,
+                    "shapes": [
+                        {"id": s["numero"], "nombre": s["nombre"], "centro": list(s["centro"])}
+                        for s in frame.result.shapes
+                    ],
+                }, ensure_ascii=False) + "\n")
+            if args.show:
+                cv2.imshow("Detector de Figuras", frame.result.annotated)
+                if cv2.waitKey(1) & 0xFF in (27, ord("q")):
+                    break
+    finally:
+        cap.release()
+        if out is not None:
+            out.close()
+        if args.show:
+            cv2.destroyAllWindows()
+
+    if latencies:
+        lat = np.array(latencies) * 1000
+        print(
+            f"Fotogramas: {len(lat)} | Descartados: {dropped} | "
+            f"Latencia media {lat.mean():.1f} ms, p95 {np.percentile(lat, 95):.1f} ms",
+            file=sys.stderr,
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Clasificador por plantillas con un índice de descriptores precalculado.
+
+Uso::
+
+    python templates.py ejemplos/ -o plantillas.npz      # construir el índice
+    python batch.py imagenes/ --templates plantillas.npz
+
+Cada plantilla es una imagen con una figura; su clase sale del nombre del
+subdirectorio (``plantillas/estrella/a.png`` -> ``estrella``) o, para imágenes
+sueltas, del nombre del archivo sin el prefijo ``ejemplo_``
+(``ejemplo_circulo.png`` -> ``Circulo``). De cada una se guarda un descriptor
+invariante a rotación, escala y traslación (ver ``shape_descriptors``).
+Clasificar N contornos es una sola búsqueda vectorizada del vecino más cercano
+entre los N descriptores y los M de la biblioteca, en lugar de un
+``cv2.matchShapes`` por contorno y plantilla.
+"""
+import argparse
+import hashlib
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from detector import (ContourFeatures, DetectionParams, ShapeDetector, classify_features,
+                      extract_features)
+
+
+TEMPLATE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+# Distancia (L1 entre descriptores) por encima de la cual se conservan las
+# reglas geométricas en lugar de la plantilla
+DEFAULT_MAX_DISTANCE = 2.0
+
+# Los momentos de Hu de orden alto son casi nulos en figuras simétricas y su
+# signo es ruido: se usa -log10(|h|) recortado a este mínimo
+HU_FLOOR = 1e-5
+# Los polígonos regulares tienen momentos de Hu casi iguales; el número de
+# vértices y la circularidad los separan
+VERTEX_WEIGHT = 5.0
+MAX_VERTICES = 12
+CIRCULARITY_WEIGHT = 2.0
+DESCRIPTOR_SIZE = 9
+
+
+def shape_descriptors(features):
+    """Descriptor por figura de ``ContourFeatures``, forma (N, 9).
+
+    Siete momentos de Hu del polígono aproximado en escala logarítmica, más el
+    número de vértices y la circularidad ponderados.
+    """
+    hu = np.array([cv2.HuMoments(cv2.moments(c)).ravel() for c in features.approx],
+                  dtype=np.float64).reshape(-1, 7)
+    return np.hstack([
+        -np.log10(np.maximum(np.abs(hu), HU_FLOOR)),
+        VERTEX_WEIGHT * np.minimum(features.vertices, MAX_VERTICES)[:, None],
+        CIRCULARITY_WEIGHT * features.circularity[:, None],
+    ])
+
+
+def _class_name(root, path):
+    parent = os.path.relpath(os.path.dirname(path), root)
+    if parent != os.curdir:
+        return parent.replace(os.sep, "/")
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if stem.startswith("ejemplo_"):
+        stem = stem[len("ejemplo_"):]
+    return stem.capitalize()
+
+
+class TemplateClassifier:
+    """Biblioteca de plantillas (``names`` y ``descriptors``) con búsqueda vectorizada.
+
+    Las figuras cuya plantilla más cercana está a más de ``max_distance``
+    conservan la clase de las reglas geométricas (``classify_features``).
+    """
+
+    def __init__(self, names, descriptors, max_distance=DEFAULT_MAX_DISTANCE):
+        self.names = list(names)
+        self.descriptors = np.asarray(descriptors, dtype=np.float64).reshape(-1, DESCRIPTOR_SIZE)
+        self.max_distance = max_distance
+        h = hashlib.blake2b(digest_size=8)
+        h.update(repr((self.names, max_distance)).encode())
+        h.update(self.descriptors.tobytes())
+        # Huella para las claves de caché de ShapeDetector
+        self.digest = h.hexdigest()
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_directory(cls, root, params=None, max_distance=DEFAULT_MAX_DISTANCE):
+        """Construye la biblioteca con la figura mayor de cada imagen bajo ``root``."""
+        params = params or DetectionParams()
+        detector = ShapeDetector(params)
+        names, shapes = [], []
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.lower().endswith(TEMPLATE_EXTENSIONS):
+                    continue
+                path = os.path.join(dirpath, filename)
+                image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+                if image is None:
+                    continue
+                features = extract_features(detector._find_contours(image), params.epsilon_factor,
+                                            params.min_area)
+                if not len(features):
+                    continue
+                names.append(_class_name(root, path))
+                shapes.append(features.take([int(np.argmax(features.area))]))
+        if not names:
+            raise ValueError(f"No se encontraron plantillas en {root}")
+        return cls(names, shape_descriptors(ContourFeatures.concat(shapes)), max_distance)
+
+    @classmethod
+    def load(cls, path, max_distance=None):
+        """Carga un índice ``.npz`` guardado con ``save`` o lo construye desde un directorio."""
+        if os.path.isdir(path):
+            return cls.from_directory(path, max_distance=max_distance or DEFAULT_MAX_DISTANCE)
+        with np.load(path, allow_pickle=False) as data:
+            stored = float(data["max_distance"])
+            return cls(data["names"].tolist(), data["descriptors"], max_distance or stored)
+
+    def save(self, path):
+        np.savez(path, names=np.array(self.names, dtype=str), descriptors=self.descriptors,
+                 max_distance=np.array(self.max_distance))
+
+    def match(self, features):
+        """Índice de la plantilla más cercana y su distancia para cada figura."""
+        query = shape_descriptors(features)
+        if not len(query) or not len(self.descriptors):
+            return np.zeros(len(query), dtype=np.int64), np.full(len(query), np.inf)
+        dist = np.abs(query[:, None, :] - self.descriptors[None, :, :]).sum(axis=2)
+        best = np.argmin(dist, axis=1)
+        return best, dist[np.arange(len(query)), best]
+
+    def classify(self, features):
+        """Nombres para ``ContourFeatures``, como ``classify_features``."""
+        names = classify_features(features)
+        best, dist = self.match(features)
+        for i in np.flatnonzero(dist <= self.max_distance).tolist():
+            names[i] = self.names[best[i]]
+        return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Construye el índice de plantillas de figuras.")
+    parser.add_argument("templates", help="Directorio de plantillas")
+    parser.add_argument("-o", "--output", required=True, help="Archivo .npz de salida")
+    parser.add_argument("--max-distance", type=float, default=DEFAULT_MAX_DISTANCE)
+    args = parser.parse_args(argv)
+
+    classifier = TemplateClassifier.from_directory(args.templates, max_distance=args.max_distance)
+    classifier.save(args.output)
+    print(f"{len(classifier)} plantillas ({len(set(classifier.names))} clases) -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
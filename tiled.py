@@ -0,0 +1,474 @@
+"""Detección por mosaicos para imágenes que no caben en memoria.
+
+La imagen se recorre en mosaicos solapados leídos bajo demanda (``.npy`` y
+``.raw`` mediante ``np.memmap``; TIFF sin comprimir mediante ``tifffile`` si está
+instalado). Cada mosaico pasa por el mismo pipeline que ``ShapeDetector``; las
+figuras que tocan un borde interior se descartan y sus trozos se agrupan y se
+vuelven a detectar sobre una ventana que las contiene completas.
+
+Las ventanas de las figuras cortadas miden como mucho ``tile_size + overlap``
+de lado, así que el pico de memoria depende del tamaño de mosaico y no del de
+la imagen; una figura más grande que eso no se puede completar y se omite.
+Como con ``RETR_EXTERNAL`` sobre la imagen completa, al unir se descarta toda
+figura cuyo centro cae dentro de otra mayor (duplicados entre mosaicos y
+bordes interiores de figuras con contorno que un mosaico dejó al descubierto).
+
+``TiledDetector.detect_roi`` usa la misma maquinaria para volver a detectar
+sólo una región de interés y unir el resultado con una detección anterior.
+"""
+import os
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+
+from detector import (ContourFeatures, DetectionCancelled, DetectionParams, DetectionResult,
+                      DetectionStats, ShapeDetector, extract_features)
+from spatial import ShapeIndex
+
+
+# Distancia (px) al borde del mosaico a partir de la cual una figura se considera cortada
+EDGE_MARGIN = 2
+
+# Detecciones como mucho por grupo de trozos al completar una figura cortada
+FRAGMENT_ATTEMPTS = 3
+
+
+def open_image_source(path, shape=None, dtype=np.uint8):
+    """Abre ``path`` como un arreglo indexable sin cargarlo entero si es posible.
+
+    Args:
+        path: ruta a ``.npy``, ``.raw``/``.bin``, ``.tif``/``.tiff`` u otro formato
+            que entienda ``cv2.imread``.
+        shape: forma ``(alto, ancho[, canales])`` obligatoria para archivos raw.
+        dtype: tipo de los píxeles en archivos raw.
+
+    Returns:
+        Un ``np.ndarray`` o ``np.memmap`` de 2 o 3 dimensiones.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npy":
+        return np.load(path, mmap_mode="r")
+    if ext in (".raw", ".bin"):
+        if shape is None:
+            raise ValueError("Los archivos raw necesitan 'shape'")
+        return np.memmap(path, dtype=dtype, mode="r", shape=tuple(shape))
+    if ext in (".tif", ".tiff"):
+        try:
+            import tifffile  # dependencia opcional, sólo necesaria para TIFF
+            return tifffile.memmap(path, mode="r")
+        except (ImportError, ValueError):
+            # Sin tifffile, o TIFF comprimido o en mosaicos: no se puede mapear
+            pass
+
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"No se pudo cargar la imagen: {path}")
+    return image
+
+
+def iter_tiles(height, width, tile_size, overlap):
+    """Genera ``(x0, y0, x1, y1, celda)`` para cada mosaico.
+
+    ``celda`` es ``(cx0, cy0, cx1, cy1)``, la parte del mosaico que no se
+    comparte con el siguiente y que decide a quién pertenece cada figura.
+    """
+    stride = tile_size - overlap
+    if stride <= 0:
+        raise ValueError("'overlap' debe ser menor que 'tile_size'")
+
+    def starts(length):
+        start = 0
+        while True:
+            yield start
+            if start + tile_size >= length:
+                return
+            start += stride
+
+    for y0 in starts(height):
+        for x0 in starts(width):
+            x1, y1 = min(x0 + tile_size, width), min(y0 + tile_size, height)
+            cx1 = width if x1 == width else x0 + stride
+            cy1 = height if y1 == height else y0 + stride
+            yield x0, y0, x1, y1, (x0, y0, cx1, cy1)
+
+
+def _to_gray(block):
+    block = np.ascontiguousarray(block)
+    if block.ndim == 3 and block.shape[2] == 4:
+        return cv2.cvtColor(block, cv2.COLOR_BGRA2GRAY)
+    if block.ndim == 3:
+        return cv2.cvtColor(block, cv2.COLOR_BGR2GRAY)
+    return block
+
+
+def _cut_mask(boxes, x0, y0, x1, y1, height, width):
+    """Rectángulos ``(x, y, w, h)`` que tocan un borde de la ventana que no es borde de la imagen."""
+    bx, by = boxes[:, 0], boxes[:, 1]
+    bx1, by1 = bx + boxes[:, 2], by + boxes[:, 3]
+    return (
+        ((x0 > 0) & (bx <= x0 + EDGE_MARGIN))
+        | ((y0 > 0) & (by <= y0 + EDGE_MARGIN))
+        | ((x1 < width) & (bx1 >= x1 - EDGE_MARGIN))
+        | ((y1 < height) & (by1 >= y1 - EDGE_MARGIN))
+    )
+
+
+def _group_boxes(boxes, limit=None):
+    """Une rectángulos ``(x0, y0, x1, y1)`` que se tocan o solapan.
+
+    Con ``limit`` no se une nada que dé un grupo de más de ``limit`` px de lado,
+    para que una fila de figuras vecinas no acabe en una ventana enorme.
+    """
+    groups = [list(b) for b in boxes]
+    merged = True
+    while merged:
+        merged = False
+        out = []
+        while groups:
+            g = groups.pop()
+            i = 0
+            while i < len(groups):
+                o = groups[i]
+                u = [min(g[0], o[0]), min(g[1], o[1]), max(g[2], o[2]), max(g[3], o[3])]
+                if (g[0] <= o[2] and o[0] <= g[2] and g[1] <= o[3] and o[1] <= g[3]
+                        and (limit is None or max(u[2] - u[0], u[3] - u[1]) <= limit)):
+                    g = u
+                    groups.pop(i)
+                    merged = True
+                else:
+                    i += 1
+            out.append(g)
+        groups = out
+    return groups
+
+
+def _inside(box, group):
+    """``True`` si el rectángulo ``(x0, y0, x1, y1)`` está dentro de ``group``."""
+    return group[0] <= box[0] and group[1] <= box[1] and box[2] <= group[2] and box[3] <= group[3]
+
+
+def _covered(bbox, box, margin=EDGE_MARGIN):
+    """Máscara de los rectángulos ``(x, y, w, h)`` que contienen ``box`` = ``(x0, y0, x1, y1)``."""
+    return ((bbox[:, 0] - margin <= box[0]) & (bbox[:, 1] - margin <= box[1])
+            & (bbox[:, 0] + bbox[:, 2] + margin >= box[2])
+            & (bbox[:, 1] + bbox[:, 3] + margin >= box[3]))
+
+
+def _within(bbox, box):
+    """Máscara de los rectángulos ``(x, y, w, h)`` contenidos en ``box`` = ``(x0, y0, x1, y1)``."""
+    return ((bbox[:, 0] >= box[0]) & (bbox[:, 1] >= box[1])
+            & (bbox[:, 0] + bbox[:, 2] <= box[2]) & (bbox[:, 1] + bbox[:, 3] <= box[3]))
+
+
+def _grow(low, high, cut_low, cut_high, out_low, out_high, limit, pad):
+    """Amplía el lado ``[low, high)`` de una ventana hacia donde sale la figura.
+
+    ``out_low``/``out_high`` dicen por qué extremos sale. Si la ventana ya mide
+    ``limit``, los extremos por los que no sale se acercan a ``pad`` px de los
+    trozos cortados (``cut_low``, ``cut_high``) para dejar sitio.
+    """
+    if high - low >= limit:
+        low = low if out_low else max(low, cut_low - pad)
+        high = high if out_high else min(high, cut_high + pad)
+    extra = max(limit - (high - low), 0)
+    if out_low and out_high:
+        return low - extra // 2, high + extra // 2
+    return low - (extra if out_low else 0), high + (extra if out_high else 0)
+
+
+def _drop_hidden(features, fragments):
+    """Quita las figuras que caben en el rectángulo de algún fragmento.
+
+    Pueden ser el interior de una figura cuyo borde exterior cortó la ventana,
+    que en la imagen completa no es un contorno externo. Devuelve las figuras
+    restantes y los fragmentos que ocultaban alguna; al volver a detectar esos
+    fragmentos enteros reaparecen las figuras que sí eran reales.
+    """
+    if not len(features) or not fragments:
+        return features, []
+    inside = np.zeros(len(features), dtype=bool)
+    hiding = []
+    for fragment in fragments:
+        within = _within(features.bbox, fragment)
+        if within.any():
+            inside |= within
+            hiding.append(fragment)
+    return features.take(~inside), hiding
+
+
+def _touches(bbox, group):
+    """Máscara de los rectángulos ``(x, y, w, h)`` que tocan ``group`` = ``(x0, y0, x1, y1)``."""
+    return ((bbox[:, 0] <= group[2]) & (bbox[:, 0] + bbox[:, 2] >= group[0])
+            & (bbox[:, 1] <= group[3]) & (bbox[:, 1] + bbox[:, 3] >= group[1]))
+
+
+class TiledDetector:
+    """Ejecuta ``ShapeDetector`` por mosaicos solapados y une los resultados."""
+
+    def __init__(self, params=None, tile_size=2048, overlap=256, classifier=None):
+        self.params = params or DetectionParams()
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self._detector = ShapeDetector(self.params, classifier=classifier)
+
+    def _detect_window(self, source, x0, y0, x1, y1):
+        """Detecta en una ventana y devuelve ``(figuras, fragmentos)`` en coordenadas globales.
+
+        ``fragmentos`` son los rectángulos ``(x0, y0, x1, y1)`` de los contornos
+        cortados por un borde interior. Se buscan antes del filtro de área porque
+        una figura cortada suele dejar sólo un arco abierto de área casi nula.
+        """
+        height, width = source.shape[:2]
+        gray = _to_gray(source[y0:y1, x0:x1])
+        contours = self._detector._find_contours(gray)
+
+        fragments = []
+        if contours:
+            boxes = np.array([cv2.boundingRect(c) for c in contours], dtype=np.int64)
+            boxes[:, :2] += (x0, y0)
+            cut = _cut_mask(boxes, x0, y0, x1, y1, height, width)
+            # Descartar ruido: un trozo de figura válida no puede ser diminuto
+            big = boxes[:, 2] * boxes[:, 3] >= self.params.min_area / 4
+            fragments = [(bx, by, bx + bw, by + bh) for bx, by, bw, bh in boxes[cut & big].tolist()]
+            contours = [c for c, is_cut in zip(contours, cut.tolist()) if not is_cut]
+
+        features = extract_features(contours, self.params.epsilon_factor, self.params.min_area)
+        features = features.shifted(x0, y0)
+        return features, fragments
+
+    def _detect_fragments(self, source, fragments, cancel=None, bounds=None):
+        """Vuelve a detectar las figuras partidas sobre ventanas que las contienen.
+
+        Cada grupo de trozos se detecta sobre su rectángulo con un pequeño
+        margen y sólo se conservan las figuras que lo tocan. Mientras alguna siga
+        cortada se repite (hasta ``FRAGMENT_ATTEMPTS`` veces) ampliando la
+        ventana hacia los bordes por los que sale, sin pasar de
+        ``tile_size + overlap`` de lado. Las ventanas no salen de ``bounds``
+        = ``(x0, y0, x1, y1)`` (por defecto, la imagen).
+        """
+        height, width = source.shape[:2]
+        bx0, by0, bx1, by1 = bounds or (0, 0, width, height)
+        limit = self.tile_size + self.overlap
+        pad = self.params.blur_kernel + EDGE_MARGIN
+
+        def clip(x0, y0, x1, y1):
+            return max(x0, bx0), max(y0, by0), min(x1, bx1), min(y1, by1)
+
+        found = []
+        for group in _group_boxes(fragments, limit):
+            gx0, gy0, gx1, gy1 = group
+            pieces = [f for f in fragments if _inside(f, group)]
+            window = clip(gx0 - pad, gy0 - pad, gx1 + pad, gy1 + pad)
+            for attempt in range(FRAGMENT_ATTEMPTS):
+                if cancel is not None and cancel.is_set():
+                    raise DetectionCancelled("mosaico")
+                features, cut = self._detect_window(source, *window)
+                # Trozos de la propia figura que siguen cortados
+                cut = [c for c in cut if c[0] <= gx1 and gx0 <= c[2] and c[1] <= gy1 and gy0 <= c[3]]
+                features, _ = _drop_hidden(features.take(_touches(features.bbox, group)), cut)
+                found.append(features)
+                # Completo si cada trozo queda dentro de alguna figura entera
+                if attempt == FRAGMENT_ATTEMPTS - 1 or all(_covered(features.bbox, f).any() for f in pieces):
+                    break
+                # La figura sigue cortada: ampliar hasta el límite hacia los
+                # bordes por los que sale
+                wx0, wy0, wx1, wy1 = window
+                wx0, wx1 = _grow(wx0, wx1, min([gx0] + [c[0] for c in cut]),
+                                 max([gx1] + [c[2] for c in cut]),
+                                 any(c[0] <= wx0 + EDGE_MARGIN for c in cut),
+                                 any(c[2] >= wx1 - EDGE_MARGIN for c in cut), limit, pad)
+                wy0, wy1 = _grow(wy0, wy1, min([gy0] + [c[1] for c in cut]),
+                                 max([gy1] + [c[3] for c in cut]),
+                                 any(c[1] <= wy0 + EDGE_MARGIN for c in cut),
+                                 any(c[3] >= wy1 - EDGE_MARGIN for c in cut), limit, pad)
+                grown = clip(wx0, wy0, wx1, wy1)
+                if grown == window:
+                    break
+                window = grown
+        return found
+
+    def detect(self, source, cancel=None):
+        """Detecta figuras en ``source`` (arreglo, memmap o ruta de archivo).
+
+        Returns:
+            DetectionResult en coordenadas de la imagen completa (sin ``annotated``).
+        """
+        if isinstance(source, (str, os.PathLike)):
+            source = open_image_source(os.fspath(source))
+
+        height, width = source.shape[:2]
+        found = []
+        fragments = []
+        hidden = []  # fragmentos que hay que volver a detectar sí o sí
+        for x0, y0, x1, y1, _cell in iter_tiles(height, width, self.tile_size, self.overlap):
+            if cancel is not None and cancel.is_set():
+                raise DetectionCancelled("mosaico")
+
+            features, cut = self._detect_window(source, x0, y0, x1, y1)
+            features, hiding = _drop_hidden(features, cut)
+            found.append(features)
+            fragments.extend(cut)
+            hidden.extend(hiding)
+
+        # Una figura que algún mosaico vio entera vale aunque aparezca en varios
+        # (dedupe_features quita las repetidas); sólo hace falta volver a
+        # detectar los trozos que ninguna cubre
+        complete = ContourFeatures.concat(found)
+        margin = self.params.blur_kernel + EDGE_MARGIN
+        hidden = set(hidden)
+        fragments = list(hidden) + [f for f in fragments if f not in hidden
+                                    and not _covered(complete.bbox, f, margin).any()]
+
+        # Figuras partidas por las costuras: volver a detectar sobre la unión
+        found = [complete] + self._detect_fragments(source, fragments, cancel)
+
+        merged = dedupe_features(ContourFeatures.concat(found))
+        return DetectionResult.from_features(merged, (height, width), self._detector.classify(merged))
+
+    def detect_roi(self, image, roi, previous=None, cancel=None):
+        """Vuelve a detectar dentro de ``roi`` = ``(x, y, ancho, alto)``.
+
+        Las figuras cortadas por el borde de la región se completan como en las
+        costuras entre mosaicos, pero sin salir de la región ampliada en
+        ``overlap`` px por cada lado, así que el coste depende del tamaño de la
+        región y no de la imagen ni de las figuras que la cruzan.
+
+        Si se pasa ``previous`` (un ``DetectionResult`` de la misma imagen), sus
+        figuras con centro dentro de la región se sustituyen por las nuevas,
+        salvo las que salen de la región ampliada, que no se pueden completar y
+        se conservan. Las figuras nuevas que repiten una conservada o caen
+        dentro de ella se descartan. Las conservadas mantienen su ``numero``;
+        cada figura nueva hereda el de la figura sustituida más cercana del
+        mismo tipo, o recibe uno nuevo.
+
+        Una región vacía o fuera de la imagen no detecta nada y devuelve
+        ``previous`` tal cual (o un resultado vacío si no se pasó).
+
+        Returns:
+            DetectionResult con las figuras ordenadas por ``numero``.
+        """
+        start = time.perf_counter()
+        height, width = image.shape[:2]
+        x, y, w, h = (int(v) for v in roi)
+        x0, y0 = min(max(x, 0), width), min(max(y, 0), height)
+        x1, y1 = min(max(x + w, x0), width), min(max(y + h, y0), height)
+        if x1 <= x0 or y1 <= y0:
+            if previous is not None:
+                return previous
+            return DetectionResult(shapes=[], contours=[], image_size=(height, width))
+        bounds = (max(x0 - self.overlap, 0), max(y0 - self.overlap, 0),
+                  min(x1 + self.overlap, width), min(y1 + self.overlap, height))
+
+        features, fragments = self._detect_window(image, x0, y0, x1, y1)
+        features, _ = _drop_hidden(features, fragments)
+        found = [features] + self._detect_fragments(image, fragments, cancel, bounds)
+        features = dedupe_features(ContourFeatures.concat(found))
+        if len(features):
+            cx, cy = features.centroid[:, 0], features.centroid[:, 1]
+            features = features.take((cx >= x0) & (cx < x1) & (cy >= y0) & (cy < y1))
+
+        kept, replaced = [], []
+        for shape, contour in zip(previous.shapes, previous.contours) if previous else ():
+            cx, cy = shape["centro"]
+            bx, by, bw, bh = cv2.boundingRect(contour)
+            inside = (x0 <= cx < x1 and y0 <= cy < y1 and bounds[0] <= bx and bounds[1] <= by
+                      and bx + bw <= bounds[2] and by + bh <= bounds[3])
+            (replaced if inside else kept).append((shape, contour))
+        if kept and len(features):
+            features = features.take(_not_in_previous(features, kept))
+        fresh = DetectionResult.from_features(features, (height, width),
+                                              self._detector.classify(features))
+
+        numbers = _inherit_numbers(fresh.shapes, [s for s, _ in replaced])
+        next_number = max([s["numero"] for s, _ in kept + replaced], default=0) + 1
+        for shape, number in zip(fresh.shapes, numbers):
+            if number is None:
+                number, next_number = next_number, next_number + 1
+            shape["numero"] = number
+
+        merged = sorted(kept + list(zip(fresh.shapes, fresh.contours)), key=lambda sc: sc[0]["numero"])
+        result = DetectionResult(
+            shapes=[s for s, _ in merged],
+            contours=[c for _, c in merged],
+            image_size=(height, width),
+        )
+        result.stats = DetectionStats(
+            timings={"roi": (time.perf_counter() - start) * 1000},
+            contours_found=len(fresh.shapes),
+            shapes_per_class=dict(Counter(s["nombre"] for s in result.shapes)),
+        )
+        return result
+
+
+def _not_in_previous(features, kept):
+    """Máscara de las figuras que no caen dentro de una conservada ni la contienen.
+
+    Con ``RETR_EXTERNAL`` dos figuras de la misma imagen nunca se contienen, así
+    que cualquier solapamiento así es una figura que ya estaba.
+    """
+    index = ShapeIndex([contour for _, contour in kept])
+    mask = np.ones(len(features), dtype=bool)
+    for i in range(len(features)):
+        point = tuple(float(v) for v in features.centroid[i])
+        for j in index.query_region(*features.bbox[i].tolist()).tolist():
+            shape, contour = kept[j]
+            if (cv2.pointPolygonTest(contour, point, False) >= 0
+                    or cv2.pointPolygonTest(features.approx[i],
+                                            tuple(float(v) for v in shape["centro"]), False) >= 0):
+                mask[i] = False
+                break
+    return mask
+
+
+def _inherit_numbers(new_shapes, old_shapes):
+    """Empareja cada figura nueva con la antigua más cercana del mismo tipo.
+
+    Sólo cuentan las parejas a menos de medio lado equivalente (``sqrt(area)/2``)
+    de la figura antigua. Devuelve el ``numero`` heredado o ``None`` por figura.
+    """
+    numbers = [None] * len(new_shapes)
+    pairs = []
+    for i, new in enumerate(new_shapes):
+        for old in old_shapes:
+            if new["nombre"] != old["nombre"]:
+                continue
+            d = np.hypot(new["centro"][0] - old["centro"][0], new["centro"][1] - old["centro"][1])
+            if d <= np.sqrt(old["area"]) / 2:
+                pairs.append((d, i, old["numero"]))
+
+    used = set()
+    for _d, i, number in sorted(pairs):
+        if numbers[i] is None and number not in used:
+            numbers[i] = number
+            used.add(number)
+    return numbers
+
+
+def dedupe_features(features):
+    """Descarta las figuras cuyo centro cae dentro de otra mayor.
+
+    Reproduce lo que ``RETR_EXTERNAL`` hace sobre la imagen completa, donde
+    ningún contorno externo queda dentro de otro: elimina tanto los duplicados
+    de una figura vista por dos ventanas como los bordes interiores de una
+    figura con contorno cuyo borde exterior cortó el mosaico.
+    """
+    n = len(features)
+    if n < 2:
+        return features
+
+    index = ShapeIndex(features.approx)
+    keep = np.zeros(n, dtype=bool)
+    for i in np.argsort(-features.area, kind="stable").tolist():
+        point = tuple(float(v) for v in features.centroid[i])
+        keep[i] = not any(
+            keep[j] and (
+                cv2.pointPolygonTest(features.approx[j], point, False) >= 0
+                # Un arco abierto puede tener el centro fuera de su polígono
+                or (np.abs(features.centroid[j] - features.centroid[i]).max() <= EDGE_MARGIN
+                    and np.abs(features.bbox[j] - features.bbox[i]).max() <= EDGE_MARGIN)
+            )
+            for j in index.query_region(*features.bbox[i].tolist()).tolist()
+        )
+    return features.take(keep)
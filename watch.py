@@ -0,0 +1,348 @@
+"""Carpeta vigilada: detecta figuras en las imágenes que van llegando a un directorio.
+
+Uso::
+
+    python watch.py entrada/ salida/ -j 4
+
+Cada pocos segundos se recorre ``entrada/`` (con subdirectorios) y cada imagen
+nueva se procesa en cuanto deja de cambiar: su tamaño y fecha de modificación
+deben mantenerse durante ``--settle`` segundos, para no leer archivos que el
+escáner aún está escribiendo. Por cada imagen se escriben en ``salida/``, con
+la misma estructura de directorios, ``<archivo>.json`` (el registro de
+``export.result_to_record``) y ``<archivo>.anotada.png``, donde ``<archivo>``
+conserva la extensión (``foto.png.json``) para que ``foto.png`` y ``foto.jpg``
+no se pisen.
+
+Las imágenes listas pasan por una cola acotada (``--max-queue``) hacia el
+``ProcessPoolExecutor``; si los trabajadores van por detrás, la cola se llena y
+se deja de recorrer la carpeta hasta que haya hueco, así que la memoria no
+crece con el número de archivos pendientes (éstos siguen en disco y se
+recogen en recorridos posteriores).
+
+``salida/manifest.jsonl`` anota cada imagen procesada con éxito con su tamaño
+y fecha de modificación. Al arrancar se lee, de modo que tras una caída o un
+reinicio sólo se procesan las imágenes nuevas o modificadas. Una imagen que
+falla se vuelve a intentar en recorridos posteriores hasta ``--max-attempts``
+veces; después se deja hasta que cambie o se reinicie el vigilante.
+
+Si un trabajador muere (p. ej. por falta de memoria) el pool queda roto; se
+crea otro y las imágenes que estaban en vuelo cuentan como un intento fallido.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+
+from batch import IMAGE_EXTENSIONS
+from detector import DetectionParams, ShapeDetector
+from export import result_to_record
+from templates import TemplateClassifier
+
+
+MANIFEST_NAME = "manifest.jsonl"
+ANNOTATED_SUFFIX = ".anotada.png"
+DEFAULT_MAX_ATTEMPTS = 3
+
+_worker_detector = None
+
+
+def _init_worker(params, classifier=None):
+    global _worker_detector
+    cv2.setNumThreads(1)
+    _worker_detector = ShapeDetector(params, classifier=classifier)
+
+
+def _write_atomic(path, data):
+    """Escribe ``data`` (bytes) en ``path`` sin dejar nunca un archivo a medias."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def process_file(path, output_stem, annotate=True):
+    """Detecta en ``path`` y escribe ``<output_stem>.json`` y la imagen anotada.
+
+    Se ejecuta en el trabajador; sólo devuelve un registro breve.
+    """
+    start = time.perf_counter()
+    # La imagen anotada necesita el color
+    image = cv2.imread(path, cv2.IMREAD_COLOR if annotate else cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return {"path": path, "ok": False, "error": "No se pudo cargar la imagen"}
+    result = _worker_detector.detect(image, annotate=annotate)
+
+    os.makedirs(os.path.dirname(output_stem) or ".", exist_ok=True)
+    if annotate:
+        ok, encoded = cv2.imencode(".png", result.annotated)
+        if not ok:
+            return {"path": path, "ok": False, "error": "No se pudo codificar la imagen anotada"}
+        _write_atomic(output_stem + ANNOTATED_SUFFIX, encoded.tobytes())
+    record = result_to_record(path, result)
+    record["seconds"] = round(time.perf_counter() - start, 6)
+    _write_atomic(output_stem + ".json",
+                  json.dumps(record, ensure_ascii=False).encode("utf-8"))
+    return {"path": path, "ok": True, "count": record["count"], "seconds": record["seconds"]}
+
+
+class HotFolderWatcher:
+    """Vigila ``input_dir`` y procesa cada imagen nueva una sola vez.
+
+    ``max_queue`` acota las imágenes listas en espera y ``max_in_flight`` las
+    enviadas al pool. ``settle`` son los segundos que una imagen debe pasar sin
+    cambiar de tamaño ni de fecha antes de procesarse, y ``max_attempts`` las
+    veces que se intenta una imagen que falla.
+    """
+
+    def __init__(self, input_dir, output_dir, params=None, workers=None, max_queue=64,
+                 max_in_flight=None, interval=1.0, settle=2.0, annotate=True, classifier=None,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.input_dir = os.path.abspath(input_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        self.params = params or DetectionParams()
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.max_in_flight = max_in_flight or self.workers * 2
+        self.interval = interval
+        self.settle = settle
+        self.annotate = annotate
+        self.classifier = classifier
+        self.max_attempts = max_attempts
+        self.counters = {"processed": 0, "failed": 0, "throttled_scans": 0, "pool_restarts": 0}
+
+        self._queue = deque()
+        self._queued = set()     # rutas relativas en la cola o en el pool
+        self._seen = {}          # ruta relativa -> (tamaño, mtime_ns, visto desde)
+        self._done = {}          # ruta relativa -> (tamaño, mtime_ns) ya procesada
+        self._failures = {}      # ruta relativa -> ((tamaño, mtime_ns), intentos fallidos)
+        self._manifest = None
+
+    # -- manifiesto -------------------------------------------------------
+
+    def _open_manifest(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, MANIFEST_NAME)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Última línea cortada por una caída
+                        continue
+                    # Los manifiestos antiguos también anotaban los fallos
+                    if entry.get("ok", True):
+                        self._done[entry["path"]] = (entry["size"], entry["mtime_ns"])
+        self._manifest = open(path, "a", encoding="utf-8")
+
+    def _mark_done(self, rel, key, record):
+        self._done[rel] = key
+        self._failures.pop(rel, None)
+        self._manifest.write(json.dumps({
+            "path": rel, "size": key[0], "mtime_ns": key[1], "ok": True, "count": record["count"],
+        }, ensure_ascii=False) + "\n")
+        # Se anota después de escribir los resultados: una caída entre ambos
+        # sólo hace que la imagen se repita
+        self._manifest.flush()
+        os.fsync(self._manifest.fileno())
+
+    def _mark_failed(self, rel, key):
+        """Cuenta un intento fallido; tras ``max_attempts`` la imagen no se repite.
+
+        Los fallos no van al manifiesto: al reiniciar se vuelve a intentar.
+        """
+        previous, attempts = self._failures.get(rel, (None, 0))
+        attempts = attempts + 1 if previous == key else 1
+        self._failures[rel] = (key, attempts)
+        if attempts >= self.max_attempts:
+            self._done[rel] = key
+
+    # -- recorrido --------------------------------------------------------
+
+    def _iter_files(self):
+        for dirpath, dirnames, filenames in os.walk(self.input_dir):
+            # No recorrer la salida si está dentro de la entrada
+            dirnames[:] = sorted(d for d in dirnames
+                                 if os.path.join(dirpath, d) != self.output_dir)
+            for name in sorted(filenames):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(dirpath, name)
+
+    def scan(self, now=None):
+        """Encola las imágenes que ya no cambian y no están hechas; devuelve cuántas."""
+        now = time.monotonic() if now is None else now
+        seen = {}
+        added = 0
+        for path in self._iter_files():
+            rel = os.path.relpath(path, self.input_dir)
+            if rel in self._queued:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Borrada o renombrada mientras se recorría
+                continue
+            key = (st.st_size, st.st_mtime_ns)
+            if not st.st_size or self._done.get(rel) == key:
+                continue
+            previous = self._seen.get(rel)
+            since = previous[2] if previous is not None and previous[:2] == key else now
+            if now - since >= self.settle and len(self._queue) < self.max_queue:
+                self._queue.append((rel, key))
+                self._queued.add(rel)
+                added += 1
+            else:
+                seen[rel] = key + (since,)
+        # Olvidar los archivos que han desaparecido
+        self._seen = seen
+        return added
+
+    # -- bucle principal --------------------------------------------------
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                   initargs=(self.params, self.classifier))
+
+    def _restart_pool(self, pool):
+        """Sustituye un pool roto; lo que tuviera en vuelo termina con error."""
+        pool.shutdown(wait=False, cancel_futures=True)
+        self.counters["pool_restarts"] += 1
+        print("Un trabajador terminó de forma inesperada; se reinicia el pool", file=sys.stderr)
+        return self._new_pool()
+
+    def run(self, stop=None, idle_exit=None):
+        """Vigila la carpeta hasta que ``stop.is_set()`` o una interrupción.
+
+        Con ``idle_exit`` termina tras ese número de segundos sin trabajo
+        pendiente (útil para procesar lo que haya y salir).
+
+        Returns:
+            dict con los contadores.
+        """
+        self._open_manifest()
+        pool = self._new_pool()
+        pending = {}  # future -> (ruta relativa, (tamaño, mtime_ns), pool)
+        idle_since = time.monotonic()
+        next_scan = 0.0
+        try:
+            while stop is None or not stop.is_set():
+                now = time.monotonic()
+                if now >= next_scan:
+                    if len(self._queue) < self.max_queue:
+                        self.scan(now)
+                    else:
+                        # Contrapresión: con la cola llena no se recorre la carpeta
+                        self.counters["throttled_scans"] += 1
+                    next_scan = now + self.interval
+
+                while self._queue and len(pending) < self.max_in_flight:
+                    rel, key = self._queue.popleft()
+                    stem = os.path.join(self.output_dir, rel)
+                    args = (process_file, os.path.join(self.input_dir, rel), stem, self.annotate)
+                    try:
+                        future = pool.submit(*args)
+                    except BrokenProcessPool:
+                        pool = self._restart_pool(pool)
+                        future = pool.submit(*args)
+                    pending[future] = (rel, key, pool)
+
+                if not pending:
+                    if self._queue or self._seen:
+                        idle_since = now
+                    elif idle_exit is not None and now - idle_since >= idle_exit:
+                        break
+                    time.sleep(max(0.0, min(self.interval, next_scan - time.monotonic())))
+                    continue
+
+                idle_since = now
+                done, _ = wait(pending, timeout=max(0.0, next_scan - time.monotonic()),
+                               return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    rel, key, owner = pending.pop(future)
+                    self._queued.discard(rel)
+                    try:
+                        record = future.result()
+                    except BrokenProcessPool as e:
+                        # Los demás trabajos del pool roto fallan igual; sólo se
+                        # reinicia si es el pool actual
+                        broken = broken or owner is pool
+                        record = {"path": rel, "ok": False, "error": str(e) or "El trabajador terminó"}
+                    except Exception as e:
+                        record = {"path": rel, "ok": False, "error": str(e)}
+                    self.counters["processed"] += 1
+                    if record["ok"]:
+                        self._mark_done(rel, key, record)
+                    else:
+                        self.counters["failed"] += 1
+                        print(f"Error en {rel}: {record['error']}", file=sys.stderr)
+                        self._mark_failed(rel, key)
+                if broken:
+                    pool = self._restart_pool(pool)
+        finally:
+            # Lo que quede en vuelo no está en el manifiesto: se repetirá al reiniciar
+            pool.shutdown(wait=False, cancel_futures=True)
+            self._manifest.close()
+            self._manifest = None
+        return dict(self.counters)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Vigila una carpeta y detecta figuras en las imágenes que llegan."
+    )
+    parser.add_argument("input", help="Carpeta vigilada (se recorre con subdirectorios)")
+    parser.add_argument("output", help="Carpeta de resultados y manifiesto")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--max-queue", type=int, default=64,
+                        help="Imágenes listas en espera antes de dejar de recorrer la carpeta")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="Imágenes enviadas al pool a la vez (por defecto 2 x procesos)")
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="Segundos entre recorridos de la carpeta")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="Segundos sin cambios para dar un archivo por terminado")
+    parser.add_argument("--no-annotate", action="store_true",
+                        help="No guardar las imágenes anotadas")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help="Intentos por imagen antes de dejarla hasta que cambie")
+    parser.add_argument("--once", action="store_true",
+                        help="Procesar lo que haya y salir cuando no quede trabajo")
+    parser.add_argument("--min-area", type=float, default=DetectionParams().min_area)
+    parser.add_argument("--templates", default=None,
+                        help="Índice .npz o directorio de plantillas (ver templates.py)")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    classifier = TemplateClassifier.load(args.templates) if args.templates else None
+    watcher = HotFolderWatcher(
+        args.input, args.output, DetectionParams(min_area=args.min_area),
+        workers=args.workers, max_queue=args.max_queue, max_in_flight=args.max_in_flight,
+        interval=args.interval, settle=args.settle, annotate=not args.no_annotate,
+        classifier=classifier, max_attempts=args.max_attempts,
+    )
+    print(f"Vigilando {watcher.input_dir} -> {watcher.output_dir}", file=sys.stderr)
+    try:
+        counters = watcher.run(idle_exit=args.settle + args.interval if args.once else None)
+    except KeyboardInterrupt:
+        counters = watcher.counters
+    print(f"Procesadas: {counters['processed']} | Fallos: {counters['failed']}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())